@@ -0,0 +1,244 @@
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from Tokens import estimate_tokens
+
+# Elements whose text is never rendered
+INVISIBLE_TAGS = ('script', 'style', 'noscript', 'template')
+
+# Elements that never carry event content
+DROP_TAGS = INVISIBLE_TAGS + ('iframe', 'svg', 'nav', 'form', 'button', 'select')
+
+# Page chrome that is only dropped when the page has no main content region
+CHROME_TAGS = ('header', 'footer', 'aside')
+
+# id / class fragments of cookie banners, "related events" carousels, share bars and the like
+BOILERPLATE_PATTERN = re.compile(
+    r'cookie|consent|gdpr|banner|newsletter|subscribe|sign-?up|social|share|related|recommend|carousel|'
+    r'breadcrumb|promo|advert|sponsor|popup|modal|navbar|menu|site-header|site-footer|comments?\b',
+    re.IGNORECASE)
+
+MAIN_REGION_XPATH = '//main | //article | //*[@role="main"] | //*[contains(@itemtype, "Event")]'
+
+MONTHS = r'jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|jun(?:e)?|jul(?:y)?|aug(?:ust)?|sep(?:t(?:ember)?)?|' \
+         r'oct(?:ober)?|nov(?:ember)?|dec(?:ember)?'
+DATE_PATTERN = re.compile(
+    rf'\b(?:{MONTHS})\b\.?\s+\d{{1,2}}|\b\d{{1,2}}\s+(?:{MONTHS})\b|\b(?:mon|tue|wed|thu|fri|sat|sun)[a-z]*day\b|'
+    r'\b\d{1,2}(?::\d{2})?\s?(?:am|pm)\b|\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}/\d{1,2}/\d{2,4}\b',
+    re.IGNORECASE)
+VENUE_PATTERN = re.compile(
+    r'\b(?:street|st\.|avenue|ave\.?|road|rd\.|boulevard|blvd|lane|plaza|square|suite|floor|venue|location|'
+    r'address|online|zoom|virtual)\b|\b[A-Z]{2}\s+\d{5}\b|\b[A-Z]{1,2}\d[A-Z\d]?\s*\d[A-Z]{2}\b',
+    re.IGNORECASE)
+
+
+# charset parameter of a Content-Type header, and the charset a page declares in its first bytes
+HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+DECLARED_CHARSET_PATTERN = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)|<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)', re.IGNORECASE)
+XML_DECLARATION_PATTERN = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+BYTE_ORDER_MARKS = ((b'\xef\xbb\xbf', 'utf-8-sig'), (b'\xff\xfe', 'utf-16'), (b'\xfe\xff', 'utf-16'))
+
+# Browsers read pages labelled Latin-1 as Windows-1252, which only differs in the otherwise unused 0x80-0x9f range
+ENCODING_ALIASES = {'iso-8859-1': 'windows-1252', 'iso8859-1': 'windows-1252', 'latin-1': 'windows-1252',
+                    'latin1': 'windows-1252'}
+
+
+def decode_html(content, content_type=None):
+    """
+    Page bytes as text, in the order browsers pick the charset: byte order mark, the charset of the Content-Type
+    header, the page's own <meta> or XML declaration, then UTF-8 with Windows-1252 as the last resort.
+    """
+    if content is None or isinstance(content, str):
+        return content or ''
+
+    candidates = [encoding for bom, encoding in BYTE_ORDER_MARKS if content.startswith(bom)]
+    header = HEADER_CHARSET_PATTERN.search(content_type or '')
+    if header:
+        candidates.append(header.group(1))
+    declared = DECLARED_CHARSET_PATTERN.search(content[:4096])
+    if declared:
+        candidates.append((declared.group(1) or declared.group(2)).decode('ascii'))
+    candidates.append('utf-8')
+
+    for encoding in candidates:
+        try:
+            return content.decode(ENCODING_ALIASES.get(encoding.lower(), encoding))
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode('windows-1252', errors='replace')
+
+
+def response_html(response):
+    """Decoded page of an HTTP or cached response, honoring the charset of its Content-Type header."""
+    return decode_html(response.content, response.headers.get('Content-Type'))
+
+
+def parse_html(html_content):
+    """
+    Parses a page into an lxml tree. Text is parsed as is, bytes are decoded with decode_html first, so use
+    response_html when the Content-Type header is at hand.
+    """
+    html_content = XML_DECLARATION_PATTERN.sub('', decode_html(html_content), count=1)
+    if not html_content:
+        return None
+    try:
+        return lxml_html.document_fromstring(html_content)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def text_lines(element):
+    """Stripped, non-empty text nodes of element, the same strings BeautifulSoup's get_text(strip=True) yields."""
+    return [text.strip() for text in element.itertext() if text.strip()]
+
+
+def drop_elements(elements):
+    """Removes elements from their tree while keeping the text that follows them."""
+    for element in elements:
+        if element.getparent() is not None:
+            element.drop_tree()
+
+
+def strip_non_content(root):
+    """Drops comments and elements whose text is never rendered."""
+    drop_elements(list(root.iter(etree.Comment, *INVISIBLE_TAGS)))
+
+
+class ContentExtractor:
+    """
+    Reduces an event page to the text worth sending to the LLM: boilerplate is removed, the main content region
+    is selected, and pages still over the token budget are cut into chunks of which only those carrying date,
+    venue or title signals are kept.
+    """
+
+    def __init__(self, token_budget=3000, chunk_tokens=300, model="gpt-3.5-turbo"):
+        """
+        Parameters:
+            token_budget (int): Maximum number of tokens of page text handed to the prompt.
+            chunk_tokens (int): Size of the chunks long pages are cut into.
+            model (str): Model whose tokenizer is used for counting.
+        """
+        self.token_budget = token_budget
+        self.chunk_tokens = chunk_tokens
+        self.model = model
+
+    @staticmethod
+    def _title(root):
+        """Best guess at the event title: og:title, then the first h1, then <title>."""
+        for xpath in ('//meta[@property="og:title"]/@content', '//h1', '//title'):
+            found = root.xpath(xpath)
+            if found:
+                text = found[0] if isinstance(found[0], str) else found[0].text_content()
+                if text.strip():
+                    return ' '.join(text.split())
+        return ''
+
+    @staticmethod
+    def _main_region(body):
+        """The largest main / article / Event element when it holds a fair share of the page, else the body."""
+        body_length = len(body.text_content())
+        candidates = [(len(element.text_content()), element) for element in body.xpath(MAIN_REGION_XPATH)]
+        if candidates:
+            length, element = max(candidates, key=lambda candidate: candidate[0])
+            if body_length and length >= 0.25 * body_length:
+                return element
+        return body
+
+    @staticmethod
+    def _remove_boilerplate(region):
+        """Drops chrome and boilerplate looking elements, never the ones holding the page's h1."""
+        protected = set()
+        for h1 in region.iter('h1'):
+            protected.update(h1.iterancestors())
+
+        # Headers, footers and asides inside a main region belong to the event, outside of one they are chrome
+        tags = DROP_TAGS + (CHROME_TAGS if region.tag == 'body' else ())
+        doomed = [element for element in region.iter(*tags) if element is not region]
+        for element in region.iter():
+            if element is region or not isinstance(element.tag, str) or element in protected:
+                continue
+            marker = f"{element.get('id', '')} {element.get('class', '')}"
+            if marker.strip() and BOILERPLATE_PATTERN.search(marker):
+                doomed.append(element)
+        drop_elements(element for element in doomed if element not in protected)
+
+    def _score(self, chunk, title_words):
+        score = 2 * len(DATE_PATTERN.findall(chunk)) + len(VENUE_PATTERN.findall(chunk))
+        if title_words:
+            chunk_words = set(re.findall(r'\w+', chunk.lower()))
+            score += 3 * len(title_words & chunk_words) / len(title_words)
+        return score
+
+    def _chunks(self, lines):
+        """Groups lines into chunks of roughly chunk_tokens tokens."""
+        chunks, current, current_tokens = [], [], 0
+        for line in lines:
+            line_tokens = estimate_tokens(line, self.model)
+            if current and current_tokens + line_tokens > self.chunk_tokens:
+                chunks.append(('\n'.join(current), current_tokens))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            chunks.append(('\n'.join(current), current_tokens))
+        return chunks
+
+    def _select_chunks(self, lines, title):
+        """Keeps the best scoring chunks that fit in the budget, in page order."""
+        chunks = self._chunks(lines)
+        title_words = set(re.findall(r'\w+', title.lower()))
+        scores = [self._score(chunk, title_words) for chunk, _ in chunks]
+
+        # Without any signal at all, the top of the page is the best we have
+        ranked = sorted(range(len(chunks)), key=lambda index: (-scores[index], index))
+        if not any(scores):
+            ranked = list(range(len(chunks)))
+
+        selected, used = set(), 0
+        for index in ranked:
+            if scores[index] <= 0 and any(scores):
+                break
+            if used + chunks[index][1] > self.token_budget:
+                continue
+            selected.add(index)
+            used += chunks[index][1]
+        return '\n'.join(chunks[index][0] for index in sorted(selected))
+
+    def extract(self, html_content):
+        """
+        Returns (text, stats) for a page, stats holds the tokens of the whole body text, of the text kept and the
+        difference between both.
+        """
+        root = parse_html(html_content)
+        body = root.find('body') if root is not None else None
+        if body is None:
+            return "", {'original_tokens': 0, 'tokens': 0, 'tokens_saved': 0}
+
+        strip_non_content(root)
+        original_tokens = estimate_tokens('\n'.join(text_lines(body)), self.model)
+
+        title = self._title(root)
+        region = self._main_region(body)
+        self._remove_boilerplate(region)
+
+        # Lines repeated across the page (share buttons, repeated dates in sticky bars) only cost tokens
+        seen, lines = set(), []
+        for line in text_lines(region):
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+        if title and title not in seen:
+            lines.insert(0, title)
+
+        text = '\n'.join(lines)
+        tokens = estimate_tokens(text, self.model)
+        if tokens > self.token_budget:
+            text = self._select_chunks(lines, title)
+            tokens = estimate_tokens(text, self.model)
+
+        return text, {'original_tokens': original_tokens, 'tokens': tokens,
+                      'tokens_saved': max(0, original_tokens - tokens)}
@@ -0,0 +1,107 @@
+import re
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+import dateparser
+
+# ISO-8601 dates, with an optional time and UTC offset, as found in meta tags and JSON-LD
+ISO_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?(?:Z|[+-]\d{2}:?\d{2})?$')
+
+# The format the extraction prompt asks for: Month Day, Year, Hour:Minute AM/PM, the time being optional
+PROMPT_PATTERN = re.compile(
+    r'^(?P<month>[A-Za-z]{3,9})\.?\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<year>\d{4})'
+    r'(?:,?\s+(?:at\s+)?(?P<hour>\d{1,2}):(?P<minute>\d{2})\s*(?P<meridiem>[AaPp]\.?[Mm]\.?))?$')
+
+MONTHS = {name: number for number, names in enumerate(
+    [('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+     ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'),
+     ('dec', 'december')], start=1) for name in names}
+
+# English only and naive datetimes, the same results dateparser gave with its defaults minus language detection
+DATEPARSER_LANGUAGES = ['en']
+DATEPARSER_SETTINGS = {'RETURN_AS_TIMEZONE_AWARE': False}
+
+
+def parse_iso(text):
+    """Parses an ISO-8601 string into a naive datetime keeping its wall clock time, None when it is not one."""
+    if not ISO_PATTERN.match(text):
+        return None
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def parse_prompt_format(text):
+    """Parses 'March 3, 2031, 10:00 AM' and its abbreviated variants, None when text has another format."""
+    match = PROMPT_PATTERN.match(text)
+    if not match:
+        return None
+    month = MONTHS.get(match['month'].lower())
+    if month is None:
+        return None
+
+    hour = minute = 0
+    if match['hour']:
+        hour, minute = int(match['hour']), int(match['minute'])
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if match['meridiem'][0].lower() == 'p' else 0)
+    try:
+        return datetime(int(match['year']), month, int(match['day']), hour, minute)
+    except ValueError:
+        return None
+
+
+class DateParser:
+    """
+    Parses the date strings of extracted events in layers: ISO-8601 and the prompt's own format are matched by
+    precompiled patterns, anything else goes to dateparser, whose results are memoized.
+    """
+
+    LAYERS = ('iso', 'prompt_format', 'memoized', 'dateparser', 'failed')
+
+    def __init__(self, cache_size=4096):
+        """
+        Parameters:
+            cache_size (int): Number of dateparser results kept.
+        """
+        self._dateparser = lru_cache(maxsize=cache_size)(self._parse_with_dateparser)
+        self._lock = threading.Lock()
+        # Set by the calling thread when the memo missed, the memo's own counters are shared by all threads
+        self._calls = threading.local()
+        self.hits = dict.fromkeys(self.LAYERS, 0)
+
+    def _parse_with_dateparser(self, text):
+        self._calls.computed = True
+        return dateparser.parse(text, languages=DATEPARSER_LANGUAGES, settings=DATEPARSER_SETTINGS)
+
+    def _count(self, layer):
+        with self._lock:
+            self.hits[layer] += 1
+
+    def parse(self, date_string):
+        """Returns the naive datetime of date_string, or None when no layer can parse it."""
+        text = ' '.join(str(date_string).split())
+        for layer, parser in (('iso', parse_iso), ('prompt_format', parse_prompt_format)):
+            parsed = parser(text)
+            if parsed is not None:
+                self._count(layer)
+                return parsed
+
+        self._calls.computed = False
+        parsed = self._dateparser(text)
+        if parsed is None:
+            self._count('failed')
+        else:
+            self._count('dateparser' if self._calls.computed else 'memoized')
+        return parsed
+
+    def stats(self):
+        """Returns the number of dates each layer resolved and the share of the fast layers."""
+        with self._lock:
+            hits = dict(self.hits)
+        total = sum(hits.values())
+        fast = hits['iso'] + hits['prompt_format'] + hits['memoized']
+        return dict(hits, total=total, fast_path_rate=fast / total if total else 0.0)
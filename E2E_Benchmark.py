@@ -0,0 +1,378 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+try:
+    import resource  # Not available on Windows, peak RSS is then not reported
+except ImportError:
+    resource = None
+
+from StructuredData import map_columns
+
+SIZES = "50,200,1000"
+
+# Share of synthetic pages of each kind: Eventbrite pages read by the site parser, pages publishing JSON-LD and
+# plain pages that need the LLM
+PAGE_MIX = "eventbrite:1,structured:1,text:2"
+
+API_KEY_ENV = 'E2E_BENCHMARK_OPENAI_KEY'
+
+# Generous limits so the benchmark measures the extractor, not the client side throttling of the real API
+STUB_RATE_LIMITS = {model: {'requests_per_minute': 1000000, 'tokens_per_minute': 100000000}
+                    for model in ('gpt-3.5-turbo', 'gpt-4')}
+
+YEAR = datetime.now().year + 1
+ADDRESS = "100 Main Street, Springfield, IL 62701"
+
+# Answers of the OpenAI stub, by the structured data field a requested column maps to
+STUB_FIELDS = {
+    'name': "Benchmark Event",
+    'start': f"March 03, {YEAR}, 10:00 AM",
+    'end': f"March 03, {YEAR}, 12:00 PM",
+    'location': ADDRESS,
+    'description': "A synthetic event served by the benchmark.",
+    'organizer': "Benchmark Organizer",
+}
+
+RELEVANCE_INPUTS = re.compile(r'THERE ARE (\d+) INPUTS')
+
+BOILERPLATE = "".join(f"<li><a href='/page/{n}'>Navigation link {n}</a></li>" for n in range(40))
+PARAGRAPH = ("Join us for an afternoon of talks and workshops about sustainability and technology. "
+             "Doors open half an hour before the start, coffee and snacks are provided. ") * 4
+
+
+def eventbrite_page(n):
+    """A page with the elements and meta tags FastHTML.eventbrite_fields reads."""
+    return f"""<html><head>
+<meta property="event:start_time" content="{YEAR}-03-03T10:00:00Z">
+<meta property="event:end_time" content="{YEAR}-03-03T12:00:00Z">
+<meta name="twitter:data1" value="{ADDRESS}">
+</head><body><nav><ul>{BOILERPLATE}</ul></nav>
+<h1 class="event-title css-0">Eventbrite Benchmark Event {n}</h1>
+<div class="event-details has-user-generated-content"><p>{PARAGRAPH}</p></div>
+<a class="descriptive-organizer-info__name-link" href="https://www.eventbrite.com/o/organizer-{n}">Organizer</a>
+<footer>{BOILERPLATE}</footer></body></html>"""
+
+
+def structured_page(n):
+    """A page publishing its event as schema.org JSON-LD."""
+    event = {
+        "@context": "https://schema.org", "@type": "Event", "name": f"Structured Benchmark Event {n}",
+        "startDate": f"{YEAR}-03-03T10:00:00", "endDate": f"{YEAR}-03-03T12:00:00",
+        "location": {"@type": "Place", "name": "Town Hall",
+                     "address": {"@type": "PostalAddress", "streetAddress": "100 Main Street",
+                                 "addressLocality": "Springfield", "addressRegion": "IL", "postalCode": "62701"}},
+        "description": PARAGRAPH.strip(), "organizer": {"@type": "Organization", "name": "Benchmark Organizer"},
+    }
+    return f"""<html><head><script type="application/ld+json">{json.dumps(event)}</script></head>
+<body><nav><ul>{BOILERPLATE}</ul></nav><main><h1>Structured Benchmark Event {n}</h1><p>{PARAGRAPH}</p></main>
+<footer>{BOILERPLATE}</footer></body></html>"""
+
+
+def text_page(n):
+    """A page without structured data, extracted by the LLM."""
+    return f"""<html><head><title>Benchmark Event {n}</title></head>
+<body><nav><ul>{BOILERPLATE}</ul></nav><main><article><h1>Benchmark Event {n}</h1>
+<p>March 3, {YEAR} from 10:00 AM to 12:00 PM at {ADDRESS}.</p><p>{PARAGRAPH}</p></article></main>
+<footer>{BOILERPLATE}</footer></body></html>"""
+
+
+PAGE_BUILDERS = {'eventbrite': eventbrite_page, 'structured': structured_page, 'text': text_page}
+
+
+def parse_mix(mix):
+    """'eventbrite:1,text:2' -> ['eventbrite', 'text', 'text'], the kinds synthetic pages cycle through."""
+    kinds = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition(':')
+        if kind.strip() not in PAGE_BUILDERS:
+            raise ValueError(f"Unknown page kind: {kind}")
+        kinds.extend([kind.strip()] * int(weight or 1))
+    return kinds
+
+
+def load_recorded_pages(cache_dir, limit=None):
+    """Pages of a PageCache written by EventExtractor, as (is_eventbrite, content, content_type)."""
+    from PageCache import PageCache
+
+    cache = PageCache(cache_dir)
+    pages = []
+    for url, content, content_type in cache.iter_pages():
+        if limit and len(pages) >= limit:
+            break
+        pages.append(('eventbrite' in url, content, content_type))
+    cache.close()
+    return pages
+
+
+class StubState:
+    """Settings and counters shared by the request handlers of the stub server."""
+
+    def __init__(self, recorded_pages, latency, error_rate, throttle_rate, seed):
+        self.recorded_pages = recorded_pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'pages': 0, 'completions': 0, 'errors': 0, 'throttled': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def draw(self):
+        """Returns (delay, outcome) of a completion request, outcome being 'ok', 'error' or 'throttled'."""
+        with self.lock:
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return delay, 'error'
+        if roll < self.error_rate + self.throttle_rate:
+            return delay, 'throttled'
+        return delay, 'ok'
+
+
+def stub_completion(request):
+    """The message of an OpenAI chat completion answering an extraction or relevance request."""
+    prompt = "\n".join(message.get('content') or '' for message in request.get('messages', []))
+    functions = request.get('functions')
+    if functions:
+        properties = functions[0]['parameters']['properties']
+        columns = map_columns({column: spec.get('description', '') for column, spec in properties.items()})
+        arguments = {column: STUB_FIELDS.get(field, "n/a") for column, field in columns.items()}
+        return {'role': 'assistant', 'content': None,
+                'function_call': {'name': functions[0]['name'], 'arguments': json.dumps(arguments)}}
+
+    inputs = RELEVANCE_INPUTS.search(prompt)
+    count = int(inputs.group(1)) if inputs else 1
+    return {'role': 'assistant', 'content': ';'.join('TRUE' if i % 2 == 0 else 'FALSE' for i in range(count))}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves synthetic and recorded event pages on GET and OpenAI chat completions on POST."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        parts = urlparse(self.path).path.strip('/').split('/')
+        content_type = 'text/html; charset=utf-8'
+        try:
+            if parts[0] == 'recorded':
+                # Recorded pages keep their original Content-Type, which may be what tells their charset
+                _, content, content_type = state.recorded_pages[int(parts[-1]) % len(state.recorded_pages)]
+                content_type = content_type or 'text/html'
+            else:
+                content = PAGE_BUILDERS[parts[0]](int(parts[-1]))
+        except (KeyError, IndexError, ValueError, ZeroDivisionError):
+            self.send_body(404, "Not found", 'text/plain')
+            return
+        state.count('pages')
+        self.send_body(200, content, content_type)
+
+    def do_POST(self):
+        state = self.server.state
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        delay, outcome = state.draw()
+        time.sleep(delay)
+
+        if outcome == 'error':
+            state.count('errors')
+            self.send_body(500, json.dumps({'error': {'message': "Stub server error", 'type': 'server_error'}}),
+                           'application/json')
+            return
+        if outcome == 'throttled':
+            state.count('throttled')
+            self.send_body(429, json.dumps({'error': {'message': "Stub rate limit", 'type': 'rate_limit_exceeded'}}),
+                           'application/json', {'Retry-After': '1'})
+            return
+
+        state.count('completions')
+        message = stub_completion(request)
+        prompt_tokens = len(json.dumps(request.get('messages', []))) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        self.send_body(200, json.dumps({
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': request.get('model'), 'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }), 'application/json')
+
+
+def start_stub_server(state):
+    """Starts the page and OpenAI stub server on a free local port, returns (server, base_url)."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name='stub-server', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def benchmark_urls(base_url, size, kinds, recorded_pages):
+    """
+    size distinct URLs cycling through the synthetic page kinds and the recorded pages. Recorded Eventbrite pages
+    keep 'eventbrite' in their URL so the site parser picks them up.
+    """
+    prefixes = list(kinds) + ['recorded/eventbrite' if is_eventbrite else 'recorded'
+                              for is_eventbrite, _, _ in recorded_pages]
+    return [f"{base_url}/{prefixes[n % len(prefixes)]}/{n}" for n in range(size)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None where the resource module is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_size(base_url, urls, work_dir, options):
+    """
+    Runs EventExtractor over urls in a fresh process, so peak RSS belongs to this size alone, and writes the
+    numbers to result.json in work_dir.
+    """
+    import openai
+
+    from EventExtractor import EventExtractor, DEFAULT_COLUMN_MAPPING
+
+    os.chdir(work_dir)
+    os.makedirs('Errors', exist_ok=True)
+    csv_file = os.path.join(work_dir, 'urls_Benchmark.csv')
+    with open(csv_file, 'w') as f:
+        f.write('url\n' + '\n'.join(urls) + '\n')
+
+    os.environ[API_KEY_ENV] = 'stub'
+    openai.api_base = f"{base_url}/v1"
+    if not options['verbose']:
+        sys.stdout = open(os.devnull, 'w')
+
+    extractor = EventExtractor(API_KEY_ENV, [csv_file], DEFAULT_COLUMN_MAPPING, 'Benchmark', work_dir, ['MAX'],
+                               fetch_concurrency=options['fetch_concurrency'], cache_dir=None, use_llm_cache=False,
+                               llm_workers=options['llm_workers'], llm_rate_limits=STUB_RATE_LIMITS,
+                               journal_dir=None, parse_workers=options['parse_workers'], metrics_interval=None)
+    start = time.perf_counter()
+    extractor.run(threading.Event())
+    seconds = time.perf_counter() - start
+
+    relevance = extractor.metrics.histograms.get(('stage_seconds', (('stage', 'relevance'),)))
+    result = {
+        'size': len(urls), 'seconds': seconds, 'urls_per_second': len(urls) / seconds, 'peak_rss_mb': peak_rss_mb(),
+        'retries': extractor.extraction_retries, 'relevance_seconds': relevance.sum if relevance else 0.0,
+        'stages': {name: {'busy_time': stage['busy_time'], 'per_second': stage['per_second'],
+                          'utilization': stage['utilization']}
+                   for name, stage in extractor.pipeline_stats.items()},
+    }
+    with open(os.path.join(work_dir, 'result.json'), 'w') as f:
+        json.dump(result, f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_result(result, baseline=None):
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "n/a"
+    line = (f"{result['size']} URLs: {result['seconds']:.2f}s, {result['urls_per_second']:.1f} URLs/sec, "
+            f"peak RSS {rss}, {result['retries']} extraction retries")
+    if baseline:
+        line += f", {result['urls_per_second'] / baseline['urls_per_second']:.2f}x baseline"
+    print(line)
+    for name, stage in result['stages'].items():
+        print(f"  {name}: busy {stage['busy_time']:.2f}s, {stage['per_second']:.1f}/s, "
+              f"utilization {stage['utilization']:.0%}")
+    print(f"  relevance: {result['relevance_seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EventExtractor.run end to end against a local page "
+                                                 "server and OpenAI stub, without network access or API costs.")
+    parser.add_argument('--sizes', default=SIZES, help="Comma separated numbers of URLs to run")
+    parser.add_argument('--mix', default=PAGE_MIX, help="Synthetic page kinds and weights")
+    parser.add_argument('--recorded-cache', help="PageCache directory served next to the synthetic pages")
+    parser.add_argument('--recorded-limit', type=int, help="Number of recorded pages to use, all when omitted")
+    parser.add_argument('--latency', type=float, default=0.2, help="Mean seconds the OpenAI stub takes per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of OpenAI requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of OpenAI requests answered with a 429")
+    parser.add_argument('--llm-workers', type=int, default=8)
+    parser.add_argument('--fetch-concurrency', type=int, default=16)
+    parser.add_argument('--parse-workers', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file the results are written to")
+    parser.add_argument('--baseline', help="JSON results of an earlier --output run to compare with")
+    parser.add_argument('--verbose', action='store_true', help="Show the extractor's own output")
+    args = parser.parse_args()
+
+    recorded = load_recorded_pages(args.recorded_cache, args.recorded_limit) if args.recorded_cache else []
+    state = StubState(recorded, args.latency, args.error_rate, args.throttle_rate, args.seed)
+    server, base_url = start_stub_server(state)
+    kinds = parse_mix(args.mix)
+    options = {'verbose': args.verbose, 'llm_workers': args.llm_workers, 'fetch_concurrency': args.fetch_concurrency,
+               'parse_workers': args.parse_workers}
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result['size']: result for result in json.load(f)['results']}
+
+    # Every size runs in its own process, started fresh rather than forked from this one
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            urls = benchmark_urls(base_url, size, kinds, recorded)
+            with tempfile.TemporaryDirectory(prefix='e2e_benchmark_') as work_dir:
+                process = context.Process(target=run_size, args=(base_url, urls, work_dir, options))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f"{size} URLs: benchmark process failed with exit code {process.exitcode}")
+                    continue
+                with open(os.path.join(work_dir, 'result.json')) as f:
+                    result = json.load(f)
+            results.append(result)
+            print_result(result, baseline.get(size))
+    finally:
+        server.shutdown()
+
+    print(f"OpenAI stub: {state.counts['completions']} completions, {state.counts['errors']} errors, "
+          f"{state.counts['throttled']} throttled; {state.counts['pages']} pages served")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': datetime.now().isoformat(), 'options': vars(args),
+                       'results': results}, f, indent=2)
+        print(f"Results saved at: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,58 @@
+import argparse
+import math
+import os
+import time
+
 import pandas as pd
-from transformers import pipeline, DistilBertTokenizer, DistilBertForSequenceClassification
 import tkinter as tk
 from tkinter import filedialog
-import torch
+
+from RelevanceBackend import DistilBertRelevanceBackend
+
+MODEL_PATH = "/Users/raiidahmed/Desktop/Models/Model_20230809_213204/checkpoint-480"
+
 
 def create_prompt_from_row(row, indices):
     return ' '.join(str(row[i]) for i in indices)
 
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, fraction between 0 and 1."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate a relevance checkpoint on a labelled CSV.")
+    parser.add_argument('--model', default=MODEL_PATH, help="Checkpoint directory saved by Train.py or ExportModel.py")
+    parser.add_argument('--baseline', help="Checkpoint to compare against, e.g. the fp32 one --model was exported from")
+    parser.add_argument('--csv', help="CSV to evaluate, a file dialog opens when omitted")
+    parser.add_argument('--batch-size', type=int, default=32, help="Rows per forward pass")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="Threads used by torch")
+    return parser.parse_args()
+
+
+def evaluate(backend, prompts, true_labels):
+    """Returns (predicted_labels, confidences, accuracy, rows_per_second, batch_latencies) of backend on prompts."""
+    start_time = time.perf_counter()
+    predictions, confidences, batch_latencies = backend.predict_texts(prompts)
+    total_time = time.perf_counter() - start_time
+
+    predicted_labels = ["True" if prediction else "False" for prediction in predictions]
+    correct_predictions = sum(1 for true, pred in zip(true_labels, predicted_labels) if str(true) == pred)
+    accuracy = correct_predictions / len(true_labels)
+    return predicted_labels, confidences, accuracy, len(prompts) / total_time, batch_latencies
+
+
 def main():
-    tokenizer = DistilBertTokenizer.from_pretrained("/Users/raiidahmed/Desktop/Models/Model_20230809_213204/checkpoint-480")
-    model = DistilBertForSequenceClassification.from_pretrained("/Users/raiidahmed/Desktop/Models/Model_20230809_213204/checkpoint-480")
+    args = parse_args()
 
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askopenfilename(title="Select a CSV file", filetypes=[("CSV files", "*.csv")])
+    file_path = args.csv
+    if not file_path:
+        root = tk.Tk()
+        root.withdraw()
+        file_path = filedialog.askopenfilename(title="Select a CSV file", filetypes=[("CSV files", "*.csv")])
 
     if not file_path:
         print("No file selected. Exiting...")
@@ -21,44 +60,45 @@ def main():
 
     df = pd.read_csv(file_path)
     indices = [0, 4, 5]
-    truth = 7
 
-    model.eval()
+    backend = DistilBertRelevanceBackend(args.model, indices, batch_size=args.batch_size, num_threads=args.threads)
 
     true_labels = df["Relevance"].tolist()
     print(true_labels)
-    predicted_labels = []
 
-    for index, row in df.iterrows():
-        prompt = create_prompt_from_row(row, indices)
+    prompts = [create_prompt_from_row(row, indices) for row in df.itertuples(index=False)]
 
-        inputs = tokenizer(prompt, truncation=True, max_length=512, padding='max_length', return_tensors="pt")
+    predicted_labels, confidences, accuracy, rows_per_second, batch_latencies = evaluate(backend, prompts,
+                                                                                         true_labels)
 
-        with torch.no_grad():
-            logits = model(**inputs).logits
-            probabilities = torch.nn.functional.softmax(logits, dim=-1)
-            prediction = torch.argmax(probabilities, dim=1).item()
-
-        sentiment = "True" if prediction == 1 else "False"
-        confidence = probabilities[0][prediction].item()
-
-        # Append predictions and confidence to the row
-        df.at[index, 'Prediction'] = sentiment
-        df.at[index, 'Confidence'] = confidence
+    # Predictions and confidence are written back as whole columns
+    df['Prediction'] = predicted_labels
+    df['Confidence'] = confidences
 
+    for index, (prompt, sentiment, confidence) in enumerate(zip(prompts, predicted_labels, confidences)):
         print(f"Row {index + 1} - Input: {prompt[:100]}... -> Sentiment: {sentiment}, Confidence: {confidence:.4f}")
 
-        # For accuracy calculation
-        predicted_labels.append(sentiment)
-
     # Save the updated DataFrame
     save_path = './Testing Results' + '/TESTED_' + file_path.split('/')[-1]
     df.to_csv(save_path, index=False)
 
-    # Calculate accuracy
-    correct_predictions = sum(1 for true, pred in zip(true_labels, predicted_labels) if str(true) == pred)
-    accuracy = correct_predictions / len(true_labels)
     print(f"Accuracy rate: {accuracy:.4f}")
+    print(f"Format: {backend.format}, loaded in {backend.load_time:.2f}s")
+    print(f"Throughput: {rows_per_second:.1f} rows/sec over {len(prompts)} rows "
+          f"(batch size {args.batch_size}, {args.threads} threads)")
+    if batch_latencies:
+        print(f"Batch latency: p50 {percentile(batch_latencies, 0.50) * 1000:.1f} ms, "
+              f"p95 {percentile(batch_latencies, 0.95) * 1000:.1f} ms over {len(batch_latencies)} batches")
+
+    if args.baseline:
+        baseline = DistilBertRelevanceBackend(args.baseline, indices, batch_size=args.batch_size,
+                                              num_threads=args.threads)
+        _, _, baseline_accuracy, baseline_rows_per_second, _ = evaluate(baseline, prompts, true_labels)
+        print(f"Baseline ({baseline.format}, loaded in {baseline.load_time:.2f}s): accuracy {baseline_accuracy:.4f}, "
+              f"{baseline_rows_per_second:.1f} rows/sec")
+        print(f"Accuracy delta: {accuracy - baseline_accuracy:+.4f}, "
+              f"speedup: {rows_per_second / baseline_rows_per_second:.2f}x, "
+              f"load time: {backend.load_time:.2f}s vs {baseline.load_time:.2f}s")
 
 
 if __name__ == "__main__":
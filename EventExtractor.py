@@ -1,16 +1,33 @@
 import os
+import json
 import time
 import string
 from urllib.parse import urlparse, urlunparse
 import pandas as pd
 import openai
-import dateparser
-import math
-import requests
-from bs4 import BeautifulSoup
 from datetime import datetime
 import logging
 import csv
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from FetchEngine import FetchEngine
+from Pipeline import Pipeline, Stage
+from HTTPClient import HTTPClient, REQUEST_ERRORS
+from Metrics import Metrics, MetricsReporter
+from PageCache import PageCache
+from RateLimiter import DomainRateLimiter, OpenAIRateLimiter, retry_after_seconds, THROTTLE_STATUSES
+from Tokens import estimate_tokens
+from LLMCache import LLMCache
+from DateParser import DateParser
+from ContentExtractor import response_html
+from FastHTML import body_text
+from RelevanceBackend import GPTRelevanceBackend, DistilBertRelevanceBackend, RELEVANCE_TEXT_COLUMNS
+from RunJournal import RunJournal, journal_path
+from PageParser import PageParser, init_worker, parse_in_worker
+from StructuredOutput import EXTRACTION_FUNCTION, event_schema, parse_event_fields
 
 class PastDateError(Exception):
     """Raised when the date is in the past."""
@@ -20,8 +37,94 @@ class AddressParseError(Exception):
     """Raised when the address parsing fails."""
     pass
 
+# Default OpenAI limits per model, override them with the llm_rate_limits argument of EventExtractor
+MODEL_RATE_LIMITS = {
+    'gpt-3.5-turbo': {'requests_per_minute': 3500, 'tokens_per_minute': 90000},
+    'gpt-4': {'requests_per_minute': 200, 'tokens_per_minute': 40000},
+}
+
+# Output columns and the prompts asking OpenAI for them, used by the GUI and the command line
+DEFAULT_COLUMN_MAPPING = {
+    'Event Name': 'The name of the event',
+    'Start': 'The start datetime of the event in the following format: Month Day, Year, Hour:Minute AM/PM',
+    'End': 'The end datetime of the event in the following format: Month Day, Year, Hour:Minute AM/PM',
+    'Location': 'The full address of the event',
+    'Description': 'A description of the event',
+    'Organizer': 'The organizer of the event',
+}
+
+ERRORS_DIR = './Errors'
+
+# A URL has a scheme and a host, what is_url checks with urlparse
+URL_PATTERN = r'[A-Za-z][A-Za-z0-9+.-]*://[^/?#\s]'
+UPPER_SCHEME_PATTERN = r'[a-z0-9+.-]*[A-Z]'
+QUERY_PATTERN = r'\?[^#]*'
+# Removed from URLs by urlparse as well
+UNSAFE_URL_CHARACTERS = r'[\t\r\n]'
+URL_COLUMN = 'URL'
+
+
+def parse_column_mapping(text):
+    """Reads 'Column: prompt' lines, one column per line, into a column mapping."""
+    return dict(line.split(": ", 1) for line in text.split("\n") if line.strip())
+
+
+def format_column_mapping(column_mapping):
+    """The 'Column: prompt' lines parse_column_mapping reads."""
+    return "\n".join(f"{column}: {prompt}" for column, prompt in column_mapping.items())
+
+
+# Terms the GPT relevance check matches events against
+RELEVANCE_TERMS = ['Climate Change', 'Plants', 'Climate', 'Technology', 'Sustainability',
+                   'Environmental Volunteering', 'Environment', 'Climate Tech',
+                   'Renewable Energy', 'Emissions', 'Carbon', 'Agriculture', 'Biodiversity',
+                   'Environmental Policy', 'Climate Awareness', 'Climate Advocacy',
+                   'Reforestation', 'Recycling', 'Human Centric Design', 'Composting', 'Wildlife',
+                   'Earth', 'Soil', 'Urban Modernization', 'Urban Restoration',
+                   'Forestry', 'Ecosystems', 'Climate Investments', 'Climate Startups',
+                   'Climate Legislation', 'Climate Activism', 'Recycled', 'Vintage', 'Compost'
+                   'Vegan', 'Green', 'Sustainable Cities', 'Urbanism', 'Sustainable Nonprofits'
+                   'Sustainable Buildings', 'Sustainable Design', 'Sustainable Architecture',
+                   'Impact Investing', 'Local Produce', 'Farmers Market', 'Vegan Market', 'Vegetables',
+                   'Plant Based']
+
+'''RELEVANCE_TERMS = ['AI Governance', 'Ethics', 'Legislation', 'Social Justice', 'Governance']'''
+
+class PageJob:
+    """A page on its way through the stages of the extraction pipeline."""
+
+    def __init__(self, index, url, response):
+        self.index = index  # position of the URL in the run, i is the 1-based number used in messages
+        self.i = index + 1
+        self.url = url
+        self.response = response
+        self.known = {}  # fields taken from the page's structured data
+        self.body_text = None
+        self.attempt = 0
+        self.rescued = False
+        self.shift = False  # the site parser failed and the page went to the LLM instead
+        self.llm_path = False
+        self.successful = False
+        self.event_details = []
+
 class EventExtractor:
-    def __init__(self, api_key_env, csv_files, column_mapping, city, output_dir=None, num_rows=None):
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36"
+    }
+    datetime_fields = {1, 2}  # indices of datetime fields in event_details
+    address_fields = 3
+    max_extraction_attempts = 10  # Will try 10 times before skipping
+    csv_chunk_rows = 100000  # rows of a CSV file read at a time
+    max_reported_rows = 20  # invalid rows printed per file, all of them go to the error log
+
+    def __init__(self, api_key_env, csv_files, column_mapping, city, output_dir=None, num_rows=None,
+                 fetch_concurrency=16, per_host_concurrency=4, http2=False, cache_dir='./Cache/pages',
+                 cache_ttl=86400, cache_max_bytes=1024 ** 3, llm_workers=8, llm_rate_limits=None,
+                 llm_cache_path='./Cache/llm_cache.sqlite', use_llm_cache=True, llm_cache_max_entries=100000,
+                 prompt_token_budget=3000, relevance_backend='gpt', relevance_model_path=None,
+                 extraction_mode='json', journal_dir='./Cache/journals', resume=False, use_structured_data=True,
+                 parse_workers=0, stage_workers=None, stage_queue_size=None, relevance_gate=None, metrics_dir=None,
+                 metrics_interval=10):
         """Initializes EventExtractor."""
 
         openai.api_key = os.environ[api_key_env]
@@ -38,11 +141,73 @@ class EventExtractor:
 
         self.error_logger = logging.getLogger('errorLogger')
         self.error_logger.setLevel(logging.ERROR)
-        error_handler = logging.FileHandler('./Errors/error_log_' + os.path.splitext(self.output_filename)[0] + '.txt')
+        os.makedirs(ERRORS_DIR, exist_ok=True)
+        error_handler = logging.FileHandler(os.path.join(ERRORS_DIR, 'error_log_' + os.path.splitext(self.output_filename)[0] + '.txt'))
         self.error_logger.addHandler(error_handler)
+        self.error_csv_lock = threading.Lock()
 
         self.output_file = os.path.join(output_dir, self.output_filename)
         self.num_rows = num_rows
+        self.fetch_concurrency = fetch_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        # Event pages are cached under their URL without query parameters, the same key used for deduplication
+        self.page_cache = PageCache(cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes,
+                                    key_func=self.strip_url_parameters) if cache_dir else None
+        self.rate_limiter = DomainRateLimiter()
+        self.http_client = HTTPClient(pool_maxsize=per_host_concurrency, http2=http2, cache=self.page_cache,
+                                      rate_limiter=self.rate_limiter, error_logger=self.error_logger)
+
+        self.llm_workers = max(1, int(llm_workers))
+        rate_limits = dict(MODEL_RATE_LIMITS, **(llm_rate_limits or {}))
+        self.llm_limiters = {model: OpenAIRateLimiter(**limits) for model, limits in rate_limits.items()}
+        self.llm_cache = LLMCache(llm_cache_path, max_entries=llm_cache_max_entries, enabled=use_llm_cache)
+
+        # Pages are trimmed to their event content before prompting, None sends the whole body text as before.
+        # Fields published as schema.org / OpenGraph data are taken from the page, the LLM only fills in the rest.
+        self.page_parser = PageParser(column_mapping, prompt_token_budget, use_structured_data)
+        self.parser_config = (column_mapping, prompt_token_budget, use_structured_data)
+        # With parse_workers > 0 pages are parsed in that many processes, scripts doing so need a __main__ guard
+        self.parse_workers = max(0, int(parse_workers or 0))
+        self.parse_pool = None
+
+        # Worker counts per pipeline stage ('parse', 'gate', 'extract', 'validate', 'sink') and the capacity of the
+        # queues between them, relevance_gate(url, known_fields, page_text) can drop pages before the LLM sees them
+        self.stage_workers = dict(stage_workers or {})
+        self.stage_queue_size = stage_queue_size
+        self.relevance_gate = relevance_gate
+        self.pipeline = None
+        self.pipeline_stats = {}
+
+        # Counters and latency histograms of the run, rewritten every metrics_interval seconds as a JSON snapshot and
+        # a Prometheus textfile next to the output (or in metrics_dir), metrics_interval None turns the files off
+        self.metrics = Metrics()
+        self.metrics_interval = metrics_interval
+        metrics_base = os.path.join(metrics_dir or output_dir, os.path.splitext(self.output_filename)[0])
+        self.metrics_json_path = metrics_base + '_metrics.json'
+        self.metrics_prometheus_path = metrics_base + '_metrics.prom'
+        self.prompt_tokens_saved = 0
+        self.prompt_stats_lock = threading.Lock()
+
+        # 'json' has the model call a function whose arguments are the columns, 'delimited' asks for ; separated text
+        if extraction_mode not in ('json', 'delimited'):
+            raise ValueError(f"Unknown extraction mode: {extraction_mode}")
+        self.extraction_mode = extraction_mode
+        self.event_schema = event_schema(column_mapping)
+        self.extraction_retries = 0
+        self.date_parser = DateParser()
+
+        self.structured_pages = 0
+        self.structured_fields = 0
+        self.retries_avoided = 0
+
+        # Every extracted row is journaled as it completes, resume skips the URLs a previous run already finished
+        self.journal_path = journal_path(journal_dir, city, csv_files) if journal_dir else None
+        self.resume = resume
+
+        if relevance_backend == 'distilbert' and not relevance_model_path:
+            raise ValueError("The distilbert relevance backend needs relevance_model_path.")
+        self.relevance_backend = relevance_backend
+        self.relevance_model_path = relevance_model_path
 
         print("csv_files: " + ', '.join(os.path.basename(path) for path in self.csv_files))
         print(f"output_file: {os.path.basename(self.output_file)}")
@@ -61,13 +226,46 @@ class EventExtractor:
 
     def save_offending_row_to_csv(self, row):
         """Save offending row to CSV."""
-        filename = './Errors/error_log_' + os.path.splitext(self.output_filename)[0] + '.csv'
-        with open(filename, 'a', newline='') as file:
+        filename = os.path.join(ERRORS_DIR, 'error_log_' + os.path.splitext(self.output_filename)[0] + '.csv')
+        with self.error_csv_lock, open(filename, 'a', newline='') as file:
             writer = csv.writer(file)
             writer.writerow([row])
 
+    @staticmethod
+    def canonicalize_urls(urls):
+        """
+        Vectorized is_url and strip_url_parameters over a Series: returns (canonical URLs, valid mask). Values are
+        stripped of surrounding whitespace, their scheme lowercased and their query removed, the fragment is kept.
+        Unlike is_url, a host starting with a space is not a URL.
+        """
+        # Substitutions only run on the rows that need them, the cheap find/contains checks decide which
+        urls = urls.fillna('').astype(str).str.strip()
+        unsafe = urls.str.contains(UNSAFE_URL_CHARACTERS, regex=True)
+        if unsafe.any():
+            urls[unsafe] = urls[unsafe].str.replace(UNSAFE_URL_CHARACTERS, '', regex=True)
+        valid = urls.str.match(URL_PATTERN)
+
+        # The query runs from the first ? up to the fragment, a ? after the # belongs to the fragment
+        query_at = urls.str.find('?')
+        fragment_at = urls.str.find('#')
+        has_query = (query_at >= 0) & ((fragment_at < 0) | (query_at < fragment_at))
+        if has_query.any():
+            urls[has_query] = urls[has_query].str.replace(QUERY_PATTERN, '', n=1, regex=True)
+        empty_fragment = urls.str.endswith('#') & (urls.str.find('#') == urls.str.len() - 1)
+        if empty_fragment.any():
+            urls[empty_fragment] = urls[empty_fragment].str[:-1]
+
+        upper_scheme = valid & urls.str.match(UPPER_SCHEME_PATTERN)
+        if upper_scheme.any():
+            urls[upper_scheme] = urls[upper_scheme].map(EventExtractor.strip_url_parameters)
+        return urls, valid
+
     def read_urls_from_csv(self):
-        """Reads URLs from a CSV file."""
+        """
+        Reads the URLs of the CSV files in chunks of csv_chunk_rows rows, so large lists load in bounded memory.
+        Rows without a valid URL in the first column are skipped and reported, duplicate URLs are dropped as they
+        are read. Returns the URLs and the rest of their rows, with City and Source CSV columns added.
+        """
         all_data = []
 
         if isinstance(self.num_rows, int):
@@ -79,55 +277,79 @@ class EventExtractor:
         else:
             raise TypeError("Invalid num_rows: Must be an int or a list of equal length to csv_files")
 
+        seen_urls = set()
         for csv_file, num_rows in zip(self.csv_files, num_rows_list):
-            if num_rows == 'MAX':
-                df = pd.read_csv(csv_file)
-            else:
-                df = pd.read_csv(csv_file, nrows=num_rows)
-
-            # If df is a Series (happens when the CSV has only one row), convert it to a DataFrame
-            if isinstance(df, pd.Series):
-                df = df.to_frame().transpose()
-
-            # Replace NaN values with an empty string
-            df.iloc[:, 0].fillna('', inplace=True)
-
-            if not df.iloc[:, 0].apply(self.is_url).all():
-                print(f"Error: {csv_file} does not contain URLs in the first column.")
+            try:
+                url_column = pd.read_csv(csv_file, nrows=0).columns[0]
+            except (pd.errors.EmptyDataError, IndexError):
+                print(f"Error: {csv_file} is empty.")
                 continue
 
-            df.iloc[:, 0] = df.iloc[:, 0].apply(self.strip_url_parameters)
-
-            df['City'] = str(csv_file).rsplit('_', 1)[-1].replace('.csv', '')
-            df['Source CSV'] = csv_file
-
-            all_data.append(df)
-
-        final_data = pd.concat(all_data)
-        final_data.reset_index(drop=True, inplace=True)
-
-        # Drop duplicate URLs here after all dataframes have been concatenated
-        final_data.drop_duplicates(subset=final_data.columns[0], keep='first', inplace=True)
-
-        all_urls = final_data.iloc[:, 0].tolist()
-        final_additional_data = final_data.iloc[:, 1:]
+            city = str(csv_file).rsplit('_', 1)[-1].replace('.csv', '')
+            kept = invalid = duplicates = 0
+            chunks = pd.read_csv(csv_file, chunksize=self.csv_chunk_rows, dtype={url_column: str},
+                                 nrows=None if num_rows == 'MAX' else num_rows)
+            for chunk in chunks:
+                urls, valid = self.canonicalize_urls(chunk[url_column])
+                for row_number, value in chunk.loc[~valid, url_column].items():
+                    # Line numbers of the file: the header is line 1
+                    self.error_logger.error(f"Invalid URL in {csv_file} line {row_number + 2}: {value}")
+                    if invalid < self.max_reported_rows:
+                        print(f"Skipping line {row_number + 2} of {csv_file}, not a URL: {value}")
+                    invalid += 1
+
+                chunk = chunk[valid].assign(**{url_column: urls[valid]})
+                chunk = chunk.drop_duplicates(subset=url_column)
+                new = [url not in seen_urls for url in chunk[url_column].tolist()]
+                duplicates += int(valid.sum()) - sum(new)
+                chunk = chunk[new]
+                seen_urls.update(chunk[url_column].tolist())
+                kept += len(chunk)
+
+                # Files name their URL column differently, a common name lines them up in the concat below
+                chunk = chunk.rename(columns={url_column: URL_COLUMN})
+                chunk['City'] = city
+                chunk['Source CSV'] = csv_file
+                all_data.append(chunk)
+
+            print(f"Read {kept} URLs from {csv_file}: {invalid} rows without a valid URL and {duplicates} duplicates "
+                  f"skipped.")
+
+        if not all_data:
+            return [], pd.DataFrame()
+        final_data = pd.concat(all_data, ignore_index=True)
+
+        all_urls = final_data[URL_COLUMN].tolist()
+        final_additional_data = final_data.drop(columns=URL_COLUMN)
 
         return all_urls, final_additional_data
 
     @staticmethod
     def extract_body_text(html_content):
         """Extracts body text from HTML content."""
-        soup = BeautifulSoup(html_content, "lxml")
-        body = soup.body
-        return body.get_text(separator="\n", strip=True) if body else ""
-
-    @staticmethod
-    def parse_dates(event_details, datetime_fields):
+        return body_text(html_content)
+
+    def page_text(self, i, html_content):
+        """Text of a page handed to the LLM, trimmed to the event content when a token budget is set."""
+        text, stats = self.page_parser.page_text(html_content)
+        self.count_prompt_tokens(i, stats)
+        return text
+
+    def count_prompt_tokens(self, i, stats):
+        """Adds up and prints the tokens prompt trimming saved on page i."""
+        if stats is None:
+            return
+        with self.prompt_stats_lock:
+            self.prompt_tokens_saved += stats['tokens_saved']
+        self.metrics.inc('tokens_total', stats['tokens_saved'], kind='trimmed')
+        print(f"Page {i}: kept {stats['tokens']} of {stats['original_tokens']} tokens ({stats['tokens_saved']} saved).")
+
+    def parse_dates(self, event_details, datetime_fields):
         current_datetime = datetime.now()
 
         for i in datetime_fields:
             date_string = event_details[i]
-            parsed_date = dateparser.parse(date_string)
+            parsed_date = self.date_parser.parse(date_string)
             if parsed_date is None:
                 raise ValueError(f"Failed to parse date: {date_string}")
             if parsed_date < current_datetime:
@@ -150,9 +372,70 @@ class EventExtractor:
 
         return event_details
 
-    def extract_event_details(self, url_content, url):
-        """Extracts event details using the OpenAI API."""
-        prompt_fields = ",".join(self.column_mapping.values())
+    def chat_completion(self, model, messages, expected_completion_tokens=256, refresh_cache=False, function=None):
+        """
+        Calls the chat completion API within the model's rate limits and returns the response text. Completions are
+        memoized in the LLM cache, refresh_cache skips the lookup but still stores the new completion, which is
+        what retries after a rejected answer want. With a function definition the model is made to call it and
+        the call's JSON arguments are returned instead.
+        """
+        system_message = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        prompt = "\n".join(m["content"] for m in messages if m["role"] != "system")
+        cache_key = self.llm_cache.make_key(model, system_message, prompt, extra=function)
+        if not refresh_cache:
+            cached_content = self.llm_cache.get(cache_key)
+            self.metrics.inc('llm_cache_total', result='hit' if cached_content is not None else 'miss')
+            if cached_content is not None:
+                return cached_content
+
+        limiter = self.llm_limiters.get(model)
+        if limiter is None:
+            limiter = self.llm_limiters[model] = OpenAIRateLimiter(**MODEL_RATE_LIMITS['gpt-4'])
+
+        prompt_tokens = sum(estimate_tokens(message["content"], model) for message in messages)
+        function_arguments = {}
+        if function is not None:
+            prompt_tokens += estimate_tokens(json.dumps(function), model)
+            function_arguments = {'functions': [function], 'function_call': {'name': function['name']}}
+        reserved_tokens = prompt_tokens + expected_completion_tokens
+        limiter.acquire(reserved_tokens)
+        self.metrics.inc('bytes_total', len(system_message.encode()) + len(prompt.encode()), direction='llm_prompt')
+        request_start = time.perf_counter()
+        try:
+            response = openai.ChatCompletion.create(model=model, messages=messages, **function_arguments)
+        except (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.APIError,
+                openai.error.Timeout, openai.error.APIConnectionError) as e:
+            self.metrics.inc('llm_errors_total', model=model, error=type(e).__name__)
+            # Pause every caller of this model, for as long as the API asked when it said so
+            limiter.penalize(retry_after_seconds(getattr(e, 'headers', None)))
+            raise
+        except openai.error.OpenAIError as e:
+            self.metrics.inc('llm_errors_total', model=model, error=type(e).__name__)
+            raise
+        finally:
+            self.metrics.observe('llm_request_seconds', time.perf_counter() - request_start, model=model)
+
+        usage = response.get("usage")
+        if usage:
+            self.metrics.inc('tokens_total', usage.get("prompt_tokens", 0), model=model, kind='prompt')
+            self.metrics.inc('tokens_total', usage.get("completion_tokens", 0), model=model, kind='completion')
+        limiter.settle(reserved_tokens, usage["total_tokens"] if usage else reserved_tokens)
+        message = response.choices[0]["message"]
+        if function is not None and message.get("function_call"):
+            content = message["function_call"]["arguments"]
+        else:
+            content = message.get("content") or ""
+        self.metrics.inc('bytes_total', len(content.encode()), direction='llm_completion')
+        self.llm_cache.put(cache_key, model, content)
+        return content
+
+    def extract_event_details(self, url_content, url, refresh_cache=False, column_mapping=None):
+        """Extracts event details using the OpenAI API, only the columns of column_mapping when it is given."""
+        column_mapping = column_mapping or self.column_mapping
+        if self.extraction_mode == 'json':
+            return self.extract_event_json(url_content, refresh_cache, column_mapping)
+
+        prompt_fields = ",".join(column_mapping.values())
         prompt = f"""
         Extract the following information from the event webpage content:
         {prompt_fields},
@@ -161,22 +444,56 @@ class EventExtractor:
 
         ---\n{url_content}\n---"""
 
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        return self.chat_completion(
+            "gpt-3.5-turbo",
+            [
                 {
                     "role": "system",
                     "content": "You are an event data extractor. All date times should not include timezone. Use a semicolon character ; to delimit different fields extracted. Do not provide field names, just the extracted field.",
                 },
                 {"role": "user", "content": prompt},
             ],
+            refresh_cache=refresh_cache,
         )
 
-        return response.choices[0]["message"]["content"]
+    def extract_event_json(self, url_content, refresh_cache=False, column_mapping=None):
+        """Extracts event details as the JSON arguments of a call to the event schema's function."""
+        column_mapping = column_mapping or self.column_mapping
+        schema = self.event_schema if column_mapping == self.column_mapping else event_schema(column_mapping)
+        prompt = f"""
+        Extract the details of the event from the webpage content and record them with {EXTRACTION_FUNCTION}.
+        The content of the webpage is:
+
+        ---\n{url_content}\n---"""
+
+        return self.chat_completion(
+            "gpt-3.5-turbo",
+            [
+                {
+                    "role": "system",
+                    "content": "You are an event data extractor. All date times should not include timezone. Leave a field empty when the page does not mention it.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            expected_completion_tokens=64 * len(column_mapping),
+            refresh_cache=refresh_cache,
+            function=schema,
+        )
+
+    def split_event_details(self, details, columns=None):
+        """
+        Splits an extraction answer into one value per column, in column_mapping order unless columns are given.
+        Returns (values, rescued), rescued tells a JSON answer that the ; split of delimited mode would have rejected.
+        """
+        if self.extraction_mode == 'delimited':
+            return [detail.replace('\n', '') for detail in details.split(';')], False  # Removing newline characters
+
+        values, repaired = parse_event_fields(details, columns or list(self.column_mapping.keys()))
+        return values, repaired or any(';' in value for value in values)
 
     @staticmethod
-    def write_events_to_csv(events, additional_data, file_path, fields):
-        """Writes event data to a CSV file."""
+    def events_dataframe(events, additional_data, fields):
+        """Builds the output table: the event rows, their URL and relevance, then the additional data."""
         df_output = pd.DataFrame(events)
         base_cols = list(fields.keys()) + ['Event URL'] + ['Relevance']
         if df_output.shape[1] > len(base_cols):
@@ -184,143 +501,193 @@ class EventExtractor:
             df_output.columns = base_cols + extra_cols
         else:
             df_output.columns = base_cols
-        df_output = pd.concat([df_output, additional_data.reset_index(drop=True)], axis=1)
-        df_output.to_csv(file_path, index=False)
+        return pd.concat([df_output, additional_data.reset_index(drop=True)], axis=1)
+
+    @staticmethod
+    def write_events_to_csv(events, additional_data, file_path, fields):
+        """Writes event data to a CSV file."""
+        EventExtractor.events_dataframe(events, additional_data, fields).to_csv(file_path, index=False)
+
+    @staticmethod
+    def override_relevance(df):
+        """Marks events that did not come from an Eventbrite listing as relevant, their listing was curated already."""
+        if 'Source CSV' in df.columns and 'Relevance' in df.columns:
+            source = df['Source CSV']
+            curated = source.notna() & ~source.astype(str).str.lower().str.contains('eventbrite', regex=False)
+            df['Relevance'] = df['Relevance'].astype(object).mask(curated, True)
+        return df
+
+    @staticmethod
+    def clean_events(df):
+        """
+        Returns the cleaned copy of the output table: ERROR rows, empty columns, the Source CSV column and
+        irrelevant events are removed. Empty strings count as empty, as they would after a CSV round trip.
+        """
+        print("Removing rows that start with 'ERROR'...")
+        first_column = df[df.columns[0]].fillna("").astype(str)
+        df = df[~first_column.str.startswith("ERROR")]
+
+        print("Removing empty columns...")
+        df = df.loc[:, (df.notna() & df.ne('')).any()]
+
+        if 'Source CSV' in df.columns:
+            print("Removing the 'Source CSV' column...")
+            df = df.drop('Source CSV', axis=1)
+
+        if 'Relevance' in df.columns:
+            print("Removing rows with 'False' in the Relevance column...")
+            df = df[df['Relevance'].astype(str).str.strip().str.lower() != 'false']
+
+            print("Removing the 'Relevance' column...")
+            df = df.drop('Relevance', axis=1)
+
+        return df
 
     def get_output_file(self):
         """Returns the output file path."""
         return self.output_file
 
-    def check_relevance(self, dataframe, terms, max_prompts_per_request=25):
+    @staticmethod
+    def relevance_batches(input_prompts, max_prompts_per_request, max_batch_tokens):
+        """Groups prompts into consecutive batches bounded by a token budget and an item count."""
+        batches, batch, batch_tokens = [], [], 0
+        for prompt in input_prompts:
+            prompt_tokens = estimate_tokens(prompt, "gpt-4")
+            if batch and (len(batch) >= max_prompts_per_request or batch_tokens + prompt_tokens > max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(prompt)
+            batch_tokens += prompt_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def check_relevance_batch(self, batch_prompts, term_string, label, max_api_retries=5, max_single_retries=3):
         """
-        Method to read input prompts from the dataframe and check their relevance against a list of terms using the GPT API.
-        The method appends the relevance result to the dataframe.
-
-        Parameters:
-            terms (list[str]): List of terms against which relevance of the input strings is to be checked.
-            max_prompts_per_request (int): Maximum number of input strings to be checked in a single API request.
+        Checks one batch of prompts. A batch whose answer count does not match is split in half and each half is
+        checked on its own, so a single troublesome input only costs small requests. A single input that keeps
+        failing gets None as its result, and so does every input of a batch that ran out of API retries.
         """
-        term_string = ', '.join(terms)
-        input_prompts = [row[0] for row in dataframe]
-        num_prompts = len(input_prompts)
-        num_requests = math.ceil(num_prompts / max_prompts_per_request)
+        attempts = max_single_retries if len(batch_prompts) == 1 else 1
+        api_retries = 0
+        attempt = 0
 
-        # Prepare a list to hold the relevance results
-        relevance_results = []
+        while attempt < attempts:
+            # Prepare the prompt string with all batch prompts included
+            batch_prompts_string = "\n---\n".join(batch_prompts)
+            prompt_string = f"""
+            For each of the following texts, give a single TRUE/FALSE value if it relates to even a single one of the following terms: {term_string}.
+            THERE ARE {len(batch_prompts)} INPUTS, SO THERE SHOULD BE {len(batch_prompts)} OUTPUTS!
+            The texts are:
 
-        print("Starting the relevance check process...\n")
+            ---\n{batch_prompts_string}\n---"""
 
-        for i in range(num_requests):
-            retries = 0
-
-            while retries < 10:
-                try:
-                    start = i * max_prompts_per_request
-                    end = min((i + 1) * max_prompts_per_request, num_prompts)
-                    batch_prompts = input_prompts[start:end]
-
-                    # Prepare the prompt string with all batch prompts included
-                    batch_prompts_string = "\n---\n".join(batch_prompts)
-                    prompt_string = f"""
-                    For each of the following texts, give a single TRUE/FALSE value if it relates to even a single one of the following terms: {term_string}.
-                    THERE ARE {len(batch_prompts)} INPUTS, SO THERE SHOULD BE {len(batch_prompts)} OUTPUTS!
-                    The texts are:
-
-                    ---\n{batch_prompts_string}\n---"""
-
-                    response = openai.ChatCompletion.create(
-                        model="gpt-4",
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": "You are a relevance checker. Use a semicolon character ; to delimit different fields extracted. Do not provide field names, just the extracted field.",
-                            },
-                            {"role": "user", "content": prompt_string},
-                        ],
-                    )
-
-                    # Print out the model's response
-                    print(f"Response for batch {i + 1}:\n{response.choices[0]['message']['content']}\n")
-
-                    # Split the model's response by the semicolon character and remove leading/trailing whitespace
-                    batch_results = [res.strip() for res in response.choices[0]["message"]["content"].split(';')]
-
-                    if len(batch_results) != len(batch_prompts):
-                        raise ValueError(
-                            "Received a different number of results than expected. Please check the model's responses.")
-
-                    relevance_results.extend([result.lower() == 'true' for result in batch_results])
-
-                    print(f"Iteration {i + 1} of {num_requests} completed successfully.")
-                    break
-
-                except Exception as e:
-                    retries += 1
-                    print(f"Error in iteration {i + 1}: {e}. Retry {retries} of 10.")
-                    self.error_logger.error(f"Error in relevance check iteration. Error: {str(e)}")
-                    time.sleep(2)  # Optional: sleep for 2 seconds before retrying
-                    if retries == 10:
-                        print("Maximum retries exceeded. Breaking the loop.")
-                        self.error_logger.error(f"Relevance check failure.")
-                        return
-
-        # Append the results to the dataframe
-        print("Relevance check process completed.")
-        return(relevance_results)
+            try:
+                content = self.chat_completion(
+                    "gpt-4",
+                    [
+                        {
+                            "role": "system",
+                            "content": "You are a relevance checker. Use a semicolon character ; to delimit different fields extracted. Do not provide field names, just the extracted field.",
+                        },
+                        {"role": "user", "content": prompt_string},
+                    ],
+                    expected_completion_tokens=4 * len(batch_prompts),
+                    refresh_cache=attempt > 0 or api_retries > 0,
+                )
+            except openai.error.OpenAIError as e:
+                # API errors say nothing about the batch itself, so the same batch is sent again
+                api_retries += 1
+                print(f"OpenAI API error in batch {label}: {e}. Retry {api_retries} of {max_api_retries}.")
+                self.error_logger.error(f"Error in relevance check batch {label}. Error: {str(e)}")
+                if api_retries >= max_api_retries:
+                    # Smaller batches would only fail the same way during an outage, so the batch is not split
+                    print(f"Relevance check failed for batch {label}, leaving its relevance empty.")
+                    return [None] * len(batch_prompts)
+                continue
 
-    @staticmethod
-    def process_eventbrite(url):
-        r = requests.get(url)
-        html_content = r.content
-        soup = BeautifulSoup(html_content, 'html.parser')
+            # Print out the model's response
+            print(f"Response for batch {label}:\n{content}\n")
 
-        h1 = soup.find('h1', class_='event-title css-0')
-        start_time_meta = soup.find('meta', property=lambda x: x == 'event:start_time' if x else False)
-        start_time_str = start_time_meta['content']
-        start_time = datetime.fromisoformat(start_time_str.replace("Z", "+00:00"))
+            # Split the model's response by the semicolon character and remove leading/trailing whitespace
+            batch_results = [res.strip() for res in content.split(';')]
+            if len(batch_results) == len(batch_prompts):
+                return [result.lower() == 'true' for result in batch_results]
 
-        end_time_meta = soup.find('meta', property=lambda x: x == 'event:end_time' if x else False)
-        end_time_str = end_time_meta['content']
-        end_time = datetime.fromisoformat(end_time_str.replace("Z", "+00:00"))
+            attempt += 1
+            print(f"Batch {label} returned {len(batch_results)} results for {len(batch_prompts)} inputs.")
+            self.error_logger.error(f"Relevance check batch {label} returned {len(batch_results)} results for "
+                                    f"{len(batch_prompts)} inputs.")
 
-        location_meta = soup.find('meta', attrs={'name': 'twitter:data1'})
-        location = location_meta['value']
+        if len(batch_prompts) == 1:
+            print(f"Relevance check failed for batch {label}, leaving its relevance empty.")
+            self.error_logger.error(f"Relevance check failure for: {batch_prompts[0]}")
+            return [None]
 
-        description = soup.find('div', class_='has-user-generated-content')
-        organizer = soup.find('a', class_='descriptive-organizer-info__name-link')
+        middle = len(batch_prompts) // 2
+        print(f"Splitting batch {label} in two.")
+        return (self.check_relevance_batch(batch_prompts[:middle], term_string, f"{label}a", max_api_retries)
+                + self.check_relevance_batch(batch_prompts[middle:], term_string, f"{label}b", max_api_retries))
 
-        return [h1.get_text(), start_time.strftime('%B %d, %Y, %I:%M %p'),
-                end_time.strftime('%B %d, %Y, %I:%M %p'), location, description.get_text(), organizer['href']]
+    def check_relevance(self, dataframe, terms, max_prompts_per_request=25, max_batch_tokens=2000, max_workers=4):
+        """
+        Method to read input prompts from the dataframe and check their relevance against a list of terms using the GPT API.
+        Returns one relevance result per row, in row order. Rows whose relevance could not be determined get None.
 
-    def process_url_with_bs(self, url):
-        """Processes a URL with BeautifulSoup."""
+        Parameters:
+            terms (list[str]): List of terms against which relevance of the input strings is to be checked.
+            max_prompts_per_request (int): Maximum number of input strings to be checked in a single API request.
+            max_batch_tokens (int): Maximum number of input tokens to be checked in a single API request.
+            max_workers (int): Number of batches checked at the same time.
+        """
+        term_string = ', '.join(terms)
+        input_prompts = [row[0] for row in dataframe]
+        batches = self.relevance_batches(input_prompts, max_prompts_per_request, max_batch_tokens)
 
-        # Mapping dictionary
-        url_mapping = {
-            'eventbrite': EventExtractor.process_eventbrite,
-            # You can add more here: 'someotherwebsite.com': process_someotherwebsite,
-        }
+        print("Starting the relevance check process...\n")
+
+        # Batches run concurrently within the gpt-4 rate limits, results are stitched back in row order
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='relevance') as pool:
+            futures = [pool.submit(self.check_relevance_batch, batch_prompts, term_string, str(i + 1))
+                       for i, batch_prompts in enumerate(batches)]
 
-        parser = None
-        for domain, parser_func in url_mapping.items():
-            if domain in url:
-                parser = parser_func
-                break
+            relevance_results = []
+            for i, future in enumerate(futures):
+                relevance_results.extend(future.result())
+                print(f"Iteration {i + 1} of {len(batches)} completed successfully.")
 
-        if not parser:
-            print(f"No parser found for URL: {url}")
-            return None
+        print("Relevance check process completed.")
+        return relevance_results
 
-        for _ in range(3):
+    def parse_page(self, i, url, response):
+        """
+        Returns the PageParser result of a page, computed by a parse worker process when the run has them. A worker
+        that failed is not fatal, the page is then parsed on this thread.
+        """
+        # The page crosses the process boundary as its compact bytes, the worker decodes it
+        content_type = response.headers.get('Content-Type')
+        if self.parse_pool is not None:
             try:
-                return parser(url)
+                return self.parse_pool.submit(parse_in_worker, url, response.content, content_type).result()
             except Exception as e:
-                print(f"Error processing URL: {url}. Error: {e}")
-                self.error_logger.error(f"Error in URl parser for {url}. Error: {str(e)}")
-        else:
-            print(f"Failed to process URL after 3 attempts: {url}")
-            self.error_logger.error(f"URL parser failure for {url}")
-            return None
+                self.error_logger.error(f"Parse worker failure for url {i}. Error: {str(e)}")
+        return self.page_parser.parse(url, response.content, content_type)
+
+    def fetch_url(self, url):
+        """Fetches a single URL."""
+        try:
+            with self.metrics.timer('stage_seconds', stage='fetch'):
+                response = self.http_client.get(url, headers=self.headers, timeout=15)
+        except REQUEST_ERRORS:
+            self.metrics.inc('retries_total', cause='fetch_error')
+            raise
+
+        self.metrics.inc('http_responses_total', status=response.status_code,
+                         source='cache' if getattr(response, 'from_cache', False) else 'network')
+        self.metrics.inc('bytes_total', len(response.content or b''), direction='fetched')
+        if response.status_code in THROTTLE_STATUSES:
+            self.metrics.inc('retries_total', cause='throttled')
+        return response
 
     def seconds_to_hms(self, seconds):
         """Convert seconds to hours, minutes, and seconds format."""
@@ -329,178 +696,378 @@ class EventExtractor:
         secs = int(seconds % 60)
         return hours, minutes, secs
 
-    def run(self, stop_event):
-        """Runs the event extractor."""
-        event_info = []
-        urls, additional_data = self.read_urls_from_csv()
-        total_urls = len(urls)
-        datetime_fields = {1, 2}  # indices of datetime fields in event_details
-        address_fields = 3
+    def print_progress(self, i, total_urls, completed, start_time):
+        """Prints the progress line with an estimate based on the URLs completed so far."""
+        elapsed_time = time.time() - start_time  # Calculate elapsed time for processed URLs
 
-        start_time = time.time()
+        # Average time per URL
+        if completed > 0:  # This is to avoid division by zero for the first URL
+            avg_time_per_url = elapsed_time / completed
+        else:
+            avg_time_per_url = 0
+
+        # Estimate time remaining
+        estimated_time_remaining = avg_time_per_url * (total_urls - completed)
+
+        elapsed_h, elapsed_m, elapsed_s = self.seconds_to_hms(elapsed_time)
+        estimated_h, estimated_m, estimated_s = self.seconds_to_hms(estimated_time_remaining)
+
+        print(
+            f"Processing URL {i} out of {total_urls}. Time elapsed: {elapsed_h}h {elapsed_m}m {elapsed_s}s. Estimated time remaining: {estimated_h}h {estimated_m}m {estimated_s}s.")
+
+    def parse_stage(self, job):
+        """Pipeline stage: site parsers, structured data and page text. Failed fetches go straight to the sink."""
+        if job.response is None:  # The fetch engine already retried and logged the failure
+            job.event_details = ['ERROR']
+            self.save_offending_row_to_csv(job.event_details)
+            return 'sink'
+
+        print(f'Attempting to process URL {job.i} with its site parser')
+        parsed = self.parse_page(job.i, job.url, job.response)
+        if parsed['site_seconds'] is not None:
+            self.metrics.observe('stage_seconds', parsed['site_seconds'], stage='site_parser')
+            self.metrics.inc('site_parser_total', result='ok' if parsed['site_row'] is not None else 'error')
+        if parsed['site_row'] is not None:
+            job.event_details = parsed['site_row'] + [self.strip_url_parameters(job.url)]
+            job.successful = True
+            return 'sink'
+        if parsed['site_error'] is not None:
+            print(f"Error processing URL: {job.url}. Error: {parsed['site_error']}")
+            self.error_logger.error(f"Error in URl parser for {job.url}. Error: {parsed['site_error']}")
+            self.error_logger.error(f"URL parser failure for {job.url}")
+            job.shift = True
+
+        job.known = dict(parsed['structured'])
+        job.body_text = parsed['text']
+        self.count_prompt_tokens(job.i, parsed['text_stats'])
+        return None
+
+    def gate_stage(self, job):
+        """
+        Pipeline stage: lets relevance_gate(url, known_fields, page_text) drop pages before any LLM call. Rejected
+        pages get an ERROR row, so they are left out of the cleaned output.
+        """
+        if self.relevance_gate is not None and not self.relevance_gate(job.url, job.known, job.body_text):
+            print(f"URL {job.i} did not pass the relevance gate.")
+            job.event_details = ['ERROR Not relevant', self.strip_url_parameters(job.url)]
+            return 'sink'
+
+        job.llm_path = True
+        if len(job.known) == len(self.column_mapping):
+            print(f'Processing URL {job.i} from its structured data')
+        else:
+            print(f'Processing URL {job.i} with GPT' +
+                  (f' ({len(job.known)} fields from structured data)' if job.known else ''))
+        return None
+
+    def retry_extraction(self, job, cause):
+        """Sends a page back to the extract stage, or to the sink once it used up its attempts."""
+        self.metrics.inc('retries_total', cause=cause)
+        job.attempt += 1
+        return 'extract' if job.attempt < self.max_extraction_attempts else 'sink'
+
+    def extract_stage(self, job):
+        """Pipeline stage: one LLM attempt for the fields the structured data did not have."""
+        # Only the fields the page's structured data does not have are asked from the LLM
+        missing = {column: prompt for column, prompt in self.column_mapping.items() if column not in job.known}
+        extracted, job.rescued = {}, False
+        try:
+            if missing:
+                if job.body_text is None:
+                    job.body_text = self.page_text(job.i, response_html(job.response))
+                # A retry means the previous answer was rejected, so it must not come back from the cache
+                if job.attempt > 0:
+                    with self.prompt_stats_lock:
+                        self.extraction_retries += 1
+                details = self.extract_event_details(job.body_text, job.url, refresh_cache=job.attempt > 0,
+                                                     column_mapping=missing)
+                values, job.rescued = self.split_event_details(details, list(missing))
+
+                # Checking if the lengths of the extraction and the requested columns match
+                if len(values) != len(missing):
+                    job.event_details = values + [self.strip_url_parameters(job.url)]
+                    raise ValueError("Event details extraction failed. Retrying...")
+                extracted = dict(zip(missing, values))
+        except openai.error.OpenAIError as e:
+            # chat_completion already paused the model's limiter for as long as the API asked
+            print("OpenAI API error encountered. Retrying...")
+            self.error_logger.error(f"OpenAI api error occurred for url {job.i}. Error: {str(e)}")
+            return self.retry_extraction(job, 'llm_error')
+        except ValueError as e:
+            print(e)
+            self.error_logger.error(f"ValueError occurred for url {job.i}. Error: {str(e)}")
+            job.known = {}  # The structured data may hold the bad value, the next attempt asks for every field
+            return self.retry_extraction(job, 'malformed_answer')
+        except Exception as e:
+            self.error_logger.error(f"General Error occurred for url {job.i}. Error: {str(e)}")
+            print(e)
+            return self.retry_extraction(job, 'other')
+
+        job.event_details = [job.known[column] if column in job.known else extracted[column]
+                             for column in self.column_mapping]
+        job.event_details.append(self.strip_url_parameters(job.url))
+        return None
+
+    def validate_stage(self, job):
+        """Pipeline stage: date and address checks, a rejected row goes back to the extract stage."""
+        try:
+            job.event_details = self.parse_dates(job.event_details, self.datetime_fields)
+            job.event_details = self.parse_addresses(job.event_details, self.address_fields)
+        except PastDateError as e:
+            print(e)
+            self.error_logger.error(f"PastDateError occurred for url {job.i}. Error: {str(e)}")
+            self.metrics.inc('pages_rejected_total', reason='past_date')
+            return 'sink'
+        except ValueError as e:
+            print(e)
+            self.error_logger.error(f"ValueError occurred for url {job.i}. Error: {str(e)}")
+            job.known = {}
+            return self.retry_extraction(job, 'date')
+        except AddressParseError as e:
+            print(e)
+            self.error_logger.error(f"AddressParseError occurred for url {job.i}. Error: {str(e)}")
+            job.known = {}
+            return self.retry_extraction(job, 'address')
+        except Exception as e:
+            self.error_logger.error(f"General Error occurred for url {job.i}. Error: {str(e)}")
+            print(e)
+            return self.retry_extraction(job, 'other')
+
+        if job.known:
+            with self.prompt_stats_lock:
+                self.structured_fields += len(job.known)
+                self.structured_pages += len(job.known) == len(self.column_mapping)
+        if job.rescued:  # Accepted as is, where delimited mode would have paid for another completion
+            with self.prompt_stats_lock:
+                self.retries_avoided += 1
+        job.successful = True
+        return None
+
+    def finish_page(self, job):
+        """Records the outcome of a page that went to the LLM: the shifted parser note and the ERROR row."""
+        if not job.llm_path:
+            return
+
+        if job.shift:
+            if job.event_details:  # Check if the list is not empty
+                GPT_row = 'BS to GPT: ' + job.event_details[0]
+                self.save_offending_row_to_csv(GPT_row)
+            else:
+                self.save_offending_row_to_csv('BS to GPT: ')
 
-        for i, url in enumerate(urls, start=1):
-            if stop_event.is_set():
-                break
+        if not job.successful:
+            print("Failed to get the correct response from OpenAI. Marking error and moving to next URL.")
+            if job.event_details:  # Check if the list is not empty
+                job.event_details[0] = 'ERROR ' + job.event_details[0]  # Replace the first value in the list with 'ERROR'
+            else:
+                job.event_details.append('ERROR ')  # If the list is empty, append 'ERROR'
+            self.save_offending_row_to_csv(job.event_details)
+
+    def sink_stage(self, job, journal=None):
+        """Pipeline stage: finishes the row of a page and journals it, so it survives a crash or cancel of the run."""
+        self.finish_page(job)
+        if journal is not None:
+            if job.response is None:
+                status = 'fetch_error'
+            elif job.event_details and str(job.event_details[0]).startswith('ERROR'):
+                status = 'error'
+            else:
+                status = 'ok'
+            journal.record(job.url, job.event_details, status)
+        self.metrics.inc('pages_total', outcome=self.page_outcome(job))
+        return None
+
+    def page_outcome(self, job):
+        """How a page ended, for the pages_total metric."""
+        if job.response is None:
+            return 'fetch_error'
+        if not job.successful:
+            return 'not_relevant' if job.event_details[:1] == ['ERROR Not relevant'] else 'error'
+        if not job.llm_path:
+            return 'site_parser'
+        return 'structured_data' if len(job.known) == len(self.column_mapping) else 'llm'
+
+    def make_relevance_backend(self, name):
+        """Builds the relevance backend called name: 'gpt' (GPT-4 API) or 'distilbert' (local checkpoint)."""
+        if name == 'gpt':
+            return GPTRelevanceBackend(self, RELEVANCE_TERMS)
+        if name == 'distilbert':
+            if not self.relevance_model_path:
+                raise ValueError("The distilbert relevance backend needs relevance_model_path.")
+            columns = list(self.column_mapping.keys())
+            text_indices = [columns.index(column) for column in RELEVANCE_TEXT_COLUMNS if column in columns] or [0]
+            return DistilBertRelevanceBackend(self.relevance_model_path, text_indices)
+        raise ValueError(f"Unknown relevance backend: {name}")
+
+    def make_pipeline(self, stop_event, journal=None):
+        """The fetch -> parse -> relevance gate -> extract -> validate -> sink pipeline of a run."""
+        workers = {'parse': self.parse_workers or 2, 'gate': 1, 'extract': self.llm_workers, 'validate': 1,
+                   'sink': 1}
+        workers.update(self.stage_workers)
+        stages = [
+            Stage('parse', self.parse_stage, workers['parse']),
+            Stage('gate', self.gate_stage, workers['gate']),
+            Stage('extract', self.extract_stage, workers['extract']),
+            Stage('validate', self.validate_stage, workers['validate']),
+            Stage('sink', lambda job: self.sink_stage(job, journal), workers['sink']),
+        ]
+        queue_size = self.stage_queue_size or self.llm_workers * 2
+        return Pipeline(stages, queue_size=queue_size, stop_event=stop_event, error_logger=self.error_logger,
+                        observer=lambda name, seconds: self.metrics.observe('stage_seconds', seconds, stage=name))
+
+    def print_pipeline_stats(self, stats):
+        """Prints the throughput and queue depth of every stage, the busiest one is the bottleneck to tune."""
+        for name, stage in stats.items():
+            print(f"Stage {name}: {stage['processed']} items, {stage['per_second']:.2f}/s, "
+                  f"{stage['workers']} workers, max queue {stage['max_queue_depth']}, {stage['utilization']:.0%} busy")
+
+    def extract_events(self, urls, stop_event, indices=None, journal=None):
+        """
+        Fetches and extracts the URLs at indices (all of them by default) through the staged pipeline. Returns
+        {index: event_details}, pages dropped by a cancel have no entry.
+        """
+        indices = list(range(len(urls))) if indices is None else list(indices)
+        return self.extract_stream(((index, urls[index]) for index in indices), stop_event, journal, len(urls))
 
-            current_time = time.time()
-            elapsed_time = current_time - start_time  # Calculate elapsed time for processed URLs
+    def extract_stream(self, pages, stop_event, journal=None, total_urls=None, keep_results=True):
+        """
+        Runs (index, url) pairs through one staged pipeline, fetch engine and parse pool and returns
+        {index: event_details}. pages may be a generator still being filled while the run goes on, like the URLs a
+        work queue worker claims, and may yield None when it has no URL at the moment (see
+        FetchEngine.fetch_in_order). Progress lines are printed when total_urls is known. With keep_results False
+        the rows are only handed to the journal and an empty dict is returned.
+        """
+        start_time = time.time()
 
-            # Average time per URL
-            if i > 1:  # This is to avoid division by zero for the first URL
-                avg_time_per_url = elapsed_time / (i - 1)
-            else:
-                avg_time_per_url = 0
-
-            # Estimate time remaining
-            estimated_time_remaining = avg_time_per_url * (total_urls - i)
-
-            elapsed_h, elapsed_m, elapsed_s = self.seconds_to_hms(elapsed_time)
-            estimated_h, estimated_m, estimated_s = self.seconds_to_hms(estimated_time_remaining)
-
-            print(
-                f"Processing URL {i} out of {total_urls}. Time elapsed: {elapsed_h}h {elapsed_m}m {elapsed_s}s. Estimated time remaining: {estimated_h}h {estimated_m}m {estimated_s}s.")
-
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36"
-            }
-
-            for _ in range(10):  # Will try 4 times before skipping
-                try:
-                    response = requests.get(url, headers=headers, timeout=15)
-                    break
-                except (requests.exceptions.RequestException, requests.exceptions.Timeout) as e:
-                    print(f"Error fetching {url}, retrying...")
-                    self.error_logger.error(f"Error fetching {url}. Error: {str(e)}")
-                    time.sleep(5)  # Optional: Wait for 5 seconds before retrying
-            else:  # This will execute if the loop has exhausted all attempts (4 tries in this case) without breaking
-                print(f"Failed to fetch {url} after 10 attempts, moving to next URL.")
-                self.error_logger.error(f"Failure fetching {url}.")
-                event_details = ['ERROR']
-                self.save_offending_row_to_csv(event_details)
-                event_info.append(event_details)
-                continue
+        fetch_engine = FetchEngine(self.fetch_url, max_concurrency=self.fetch_concurrency,
+                                   per_host_concurrency=self.per_host_concurrency, rate_limiter=self.rate_limiter,
+                                   error_logger=self.error_logger)
+        self.pipeline = pipeline = self.make_pipeline(stop_event, journal)
+        sink = pipeline.stages[-1]
+
+        # Indices of the URLs handed to the fetch engine, which returns them in the same order
+        positions = deque()
+
+        def page_urls():
+            for page in pages:
+                if page is not None:
+                    positions.append(page[0])
+                    page = page[1]
+                yield page
+
+        def fetched_pages():
+            # The fetch stage: the pipeline stops pulling pages while the parse queue is full
+            for url, response in fetch_engine.fetch_in_order(page_urls(), stop_event):
+                index = positions.popleft()
+                if total_urls is not None:
+                    self.print_progress(index + 1, total_urls, sink.processed, start_time)
+                yield PageJob(index, url, response)
+
+        # Fetch, pipeline and metrics threads are already running, a forked worker could inherit a lock one of them
+        # holds. Spawned workers start from scratch, init_worker sets up all they need
+        self.parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                              mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+                                              initargs=self.parser_config) if self.parse_workers else None
+        try:
+            jobs = pipeline.run(fetched_pages(), source_name='fetch', keep_results=keep_results)
+        finally:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown(cancel_futures=True)
+                self.parse_pool = None
+
+        self.pipeline_stats = pipeline.stats()
+        self.print_pipeline_stats(self.pipeline_stats)
+        return {job.index: job.event_details for job in jobs}
+
+    def run(self, stop_event, relevance_backend=None, resume=None):
+        """
+        Runs the event extractor. relevance_backend overrides the backend chosen at construction, resume the
+        resume flag: when set, URLs already in this run's journal are taken from it instead of being processed.
+        """
+        urls, additional_data = self.read_urls_from_csv()
+        total_urls = len(urls)
 
-            body_text = self.extract_body_text(response.text)
-            event_details = []
-
-            soup_flag = False
-
-            print(f'Attempting to process URL {i} with Beautiful Soup')
-            if 'eventbrite' in url:
-                event_details = self.process_url_with_bs(url)
-                if event_details != None:
-                    event_details.append(self.strip_url_parameters(url))
-                    soup_flag = True
-                else:
-                    soup_flag = 'SHIFT'
-
-            if soup_flag == False or soup_flag == 'SHIFT':
-                print(f'Processing URL {i} with GPT')
-                for _ in range(10):  # Will try 4 times before skipping
-                    successful = False  # Create a success flag
-                    try:
-                        details = self.extract_event_details(body_text, url)
-                        event_details = [detail.replace('\n', '') for detail in
-                                         details.split(';')]  # Removing newline characters
-                        event_details.append(self.strip_url_parameters(url))
-
-                        # Checking if the lengths of the extraction and the column mapping match
-                        if len(event_details) - 1 != len(self.column_mapping):  # subtract 1 because we appended the URL
-                            raise ValueError("Event details extraction failed. Retrying...")  # Raise an error to trigger the retry
-
-                        event_details = self.parse_dates(event_details, datetime_fields)
-                        event_details = self.parse_addresses(event_details, address_fields)
-
-                        successful = True
-                        break  # If successful, we break the loop and do not execute the 'else' clause.
-                    except openai.error.OpenAIError as e:
-                        print("OpenAI API error encountered. Retrying in 30 seconds...")
-                        self.error_logger.error(f"OpenAI api error occurred for url {i}. Error: {str(e)}")
-                        time.sleep(30)
-                    except ValueError as e:
-                        print(e)
-                        self.error_logger.error(f"ValueError occurred for url {i}. Error: {str(e)}")
-                        continue
-                    except PastDateError as e:
-                        print(e)
-                        self.error_logger.error(f"PastDateError occurred for url {i}. Error: {str(e)}")
-                        break
-                    except AddressParseError as e:
-                        print(e)
-                        self.error_logger.error(f"AddressParseError occurred for url {i}. Error: {str(e)}")
-                        continue
-                    except Exception as e:
-                        self.error_logger.error(f"General Error occurred for url {i}. Error: {str(e)}")
-                        print(e)
-                        continue
-
-                if soup_flag == 'SHIFT':
-                    if event_details:  # Check if the list is not empty
-                        GPT_row = 'BS to GPT: ' + event_details[0]
-                        self.save_offending_row_to_csv(GPT_row)
-                    else:
-                        GPT_row.append('BS to GPT: ')
-                        self.save_offending_row_to_csv(GPT_row)
-
-                if not successful:
-                    print("Failed to get the correct response from OpenAI. Marking error and moving to next URL.")
-                    if event_details:  # Check if the list is not empty
-                        event_details[0] = 'ERROR ' + event_details[0] # Replace the first value in the list with 'ERROR'
-                        self.save_offending_row_to_csv(event_details)
-                    else:
-                        event_details.append('ERROR ')  # If the list is empty, append 'ERROR'
-                        self.save_offending_row_to_csv(event_details)
-
-            event_info.append(event_details)
-
-        terms = ['Climate Change', 'Plants', 'Climate', 'Technology', 'Sustainability',
-                 'Environmental Volunteering', 'Environment', 'Climate Tech',
-                 'Renewable Energy', 'Emissions', 'Carbon', 'Agriculture', 'Biodiversity',
-                 'Environmental Policy', 'Climate Awareness', 'Climate Advocacy',
-                 'Reforestation', 'Recycling', 'Human Centric Design', 'Composting', 'Wildlife',
-                 'Earth', 'Soil', 'Urban Modernization', 'Urban Restoration',
-                 'Forestry', 'Ecosystems', 'Climate Investments', 'Climate Startups',
-                 'Climate Legislation', 'Climate Activism', 'Recycled', 'Vintage', 'Compost'
-                 'Vegan', 'Green', 'Sustainable Cities', 'Urbanism', 'Sustainable Nonprofits'
-                 'Sustainable Buildings', 'Sustainable Design', 'Sustainable Architecture',
-                 'Impact Investing', 'Local Produce', 'Farmers Market', 'Vegan Market', 'Vegetables',
-                 'Plant Based']
-
-        '''terms = ['AI Governance', 'Ethics', 'Legislation', 'Social Justice', 'Governance']'''
-
-        event_info = [row + [value] for row, value in zip(event_info, self.check_relevance(event_info, terms))]
-        self.write_events_to_csv(event_info, additional_data, self.output_file, self.column_mapping)
-        pd.read_csv(self.output_file).pipe(lambda df: df.assign(Relevance=df.apply(lambda row: True if not pd.isna(row['Source CSV']) and 'eventbrite' not in row['Source CSV'].lower() else row['Relevance'], axis=1))).to_csv(self.output_file, index=False)
+        # Built up front so a missing checkpoint or torch install fails before any paid work is done
+        backend = self.make_relevance_backend(relevance_backend or self.relevance_backend)
+
+        resume = self.resume if resume is None else resume
+        journal = RunJournal(self.journal_path, resume=resume) if self.journal_path else None
+        rows = {}
+        if journal is not None:
+            for index, url in enumerate(urls):
+                row = journal.completed(url)
+                if row is not None:
+                    rows[index] = row
+            if resume:
+                print(f"Resuming from {self.journal_path}: {len(rows)} of {total_urls} URLs already done.")
+        remaining = [index for index in range(total_urls) if index not in rows]
+
+        reporter = None
+        if self.metrics_interval:
+            reporter = MetricsReporter(self.metrics, self.metrics_json_path, self.metrics_prometheus_path,
+                                       interval=self.metrics_interval, refresh=self.refresh_metrics)
+            reporter.start()
+        try:
+            try:
+                rows.update(self.extract_events(urls, stop_event, remaining, journal))
+            finally:
+                if journal is not None:
+                    journal.close()
+
+            # A cancelled run keeps the rows it has, together with their own additional data
+            done = sorted(rows)
+            if not done:
+                print("No events were extracted, no output file written.")
+                return
+            self.finalize([rows[index] for index in done], additional_data.iloc[done], backend)
+        finally:
+            if reporter is not None:
+                reporter.stop()
+                print(f"Metrics saved at: {self.metrics_json_path}")
+
+    def refresh_metrics(self):
+        """Updates the gauges that are read rather than counted: queue depths, caches and date parser layers."""
+        if self.pipeline is not None:
+            for name, stage in self.pipeline.stats().items():
+                self.metrics.set_gauge('pipeline_queue_depth', stage['queue_depth'], stage=name)
+                self.metrics.set_gauge('pipeline_items_per_second', stage['per_second'], stage=name)
+        for result, value in self.llm_cache.stats().items():
+            self.metrics.set_gauge('llm_cache', value, stat=result)
+        if self.page_cache is not None:
+            for result, value in self.page_cache.stats().items():
+                self.metrics.set_gauge('page_cache', value, stat=result)
+        date_stats = self.date_parser.stats()
+        for layer in DateParser.LAYERS:
+            self.metrics.set_gauge('dates_parsed', date_stats[layer], layer=layer)
+
+    def finalize(self, event_info, additional_data, backend):
+        """Checks the relevance of the extracted rows, writes the output CSV and its cleaned copy."""
+        with self.metrics.timer('stage_seconds', stage='relevance'):
+            relevance = backend.predict(event_info)
+        for value in relevance:
+            self.metrics.inc('relevance_total', result=str(value).lower())
+        event_info = [row + [value] for row, value in zip(event_info, relevance)]
+        # Relevance override and cleaning run on the table in memory, each output is written exactly once
+        df = self.override_relevance(self.events_dataframe(event_info, additional_data, self.column_mapping))
+        df.to_csv(self.output_file, index=False)
 
         print(f"The output CSV {self.output_file} has been saved. It contains {len(event_info)} rows.")
+        llm_cache_stats = self.llm_cache.stats()
+        print(f"LLM cache: {llm_cache_stats['hits']} hits, {llm_cache_stats['misses']} misses.")
+        print(f"Prompt trimming saved {self.prompt_tokens_saved} tokens.")
+        date_stats = self.date_parser.stats()
+        print(f"Dates: {date_stats['iso']} ISO, {date_stats['prompt_format']} prompt format, "
+              f"{date_stats['memoized']} memoized, {date_stats['dateparser']} dateparser, {date_stats['failed']} failed "
+              f"({date_stats['fast_path_rate']:.0%} without calling dateparser).")
+        print(f"Structured data: {self.structured_pages} pages without an LLM call, "
+              f"{self.structured_fields} fields in total.")
+        print(f"Extraction: {self.extraction_retries} retries, {self.retries_avoided} avoided by the "
+              f"{self.extraction_mode} mode.")
 
         print("Starting the CSV cleaning process...")
-        df = pd.read_csv(self.output_file)
-
-        print("Removing rows that start with 'ERROR'...")
-        df[df.columns[0]] = df[df.columns[0]].fillna("").astype(str)
-        df = df[~df[df.columns[0]].str.startswith("ERROR")]
+        df = self.clean_events(df)
 
-        print("Removing empty columns...")
-        df = df.dropna(axis=1, how='all')
-
-        if 'Source CSV' in df.columns:
-            print("Removing the 'Source CSV' column...")
-            df = df.drop('Source CSV', axis=1)
-
-        if 'Relevance' in df.columns:
-            relevance_empty = pd.isnull(df['Relevance']).all()
-            if not relevance_empty:
-                print("Removing rows with 'False' in the Relevance column...")
-                df['Relevance'] = df['Relevance'].astype(str)
-                df = df[df['Relevance'].str.strip().str.lower() != 'false']
-
-                print("Removing the 'Relevance' column...")
-                df = df.drop('Relevance', axis=1)
-
-        new_file_path = "/".join(self.output_file.split("/")[:-1]) + "/Cleaned_" + self.output_file.split("/")[-1]
+        new_file_path = os.path.join(os.path.dirname(self.output_file),
+                                     "Cleaned_" + os.path.basename(self.output_file))
         df.to_csv(new_file_path, index=False)
         print(f"CSV cleaning process completed! File saved at: {new_file_path}")
-
-
@@ -0,0 +1,176 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import traceback
+
+from EventExtractor import EventExtractor, DEFAULT_COLUMN_MAPPING, parse_column_mapping
+
+# Settings a config file may hold, flags given on the command line take precedence over them
+CONFIG_KEYS = ('csv_files', 'identifier', 'output_dir', 'column_mapping', 'num_rows', 'api_key_env',
+               'fetch_concurrency', 'per_host_concurrency', 'http2', 'llm_workers', 'parse_workers', 'stage_workers',
+               'stage_queue_size', 'cache_dir', 'cache_ttl', 'cache_max_bytes', 'llm_cache_path', 'use_llm_cache',
+               'prompt_token_budget', 'relevance_backend', 'relevance_model_path', 'extraction_mode', 'journal_dir',
+               'resume', 'use_structured_data', 'metrics_dir', 'metrics_interval')
+
+
+def expand_csv_files(patterns):
+    """CSV files matching the glob patterns, in order and without duplicates."""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.expanduser(pattern))) or ([pattern] if os.path.isfile(pattern) else [])
+        if not matches:
+            print(f"No CSV files match: {pattern}")
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def load_column_mapping(value):
+    """A column mapping given as a dict, a JSON file or a file of 'Column: prompt' lines, the default when None."""
+    if value is None:
+        return dict(DEFAULT_COLUMN_MAPPING)
+    if isinstance(value, dict):
+        return value
+    with open(value) as f:
+        text = f.read()
+    return json.loads(text) if text.lstrip().startswith('{') else parse_column_mapping(text)
+
+
+def parse_num_rows(value):
+    """'MAX', '100' or '100,MAX,50' (one per CSV file) in the form EventExtractor takes."""
+    if isinstance(value, (int, list)):
+        return value if isinstance(value, list) else [value]
+    return [part if part == 'MAX' else int(part) for part in str(value).split(',')]
+
+
+def parse_stage_workers(value):
+    """'parse=4,extract=16' -> {'parse': 4, 'extract': 16}."""
+    if not value or isinstance(value, dict):
+        return value or None
+    return {name.strip(): int(count) for name, _, count in (part.partition('=') for part in value.split(','))}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extract events from the URLs in CSV files without the GUI.")
+    parser.add_argument('csv_files', nargs='*', help="CSV files or glob patterns, URLs in the first column")
+    parser.add_argument('--config', help="JSON file with any of the settings below, using their long names with _")
+    parser.add_argument('--identifier', help="Name of the run, used in the output file name (the GUI's Identifier)")
+    parser.add_argument('--output-dir', default=os.getcwd())
+    parser.add_argument('--column-mapping', help="JSON file or file of 'Column: prompt' lines, the GUI default when "
+                                                 "omitted")
+    parser.add_argument('--num-rows', default='MAX', help="Rows read from each CSV file: MAX, a number or one per file")
+    parser.add_argument('--api-key-env', default='OPENAI_API_KEY', help="Environment variable holding the API key")
+
+    concurrency = parser.add_argument_group('concurrency')
+    concurrency.add_argument('--fetch-concurrency', type=int, default=16)
+    concurrency.add_argument('--per-host-concurrency', type=int, default=4)
+    concurrency.add_argument('--http2', action='store_true', default=False)
+    concurrency.add_argument('--llm-workers', type=int, default=8)
+    concurrency.add_argument('--parse-workers', type=int, default=0, help="Processes parsing pages, 0 for none")
+    concurrency.add_argument('--stage-workers', help="Threads per pipeline stage, e.g. parse=4,extract=16")
+    concurrency.add_argument('--stage-queue-size', type=int)
+
+    caching = parser.add_argument_group('caching')
+    caching.add_argument('--cache-dir', default='./Cache/pages', help="Page cache directory")
+    caching.add_argument('--no-page-cache', dest='cache_dir', action='store_const', const=None)
+    caching.add_argument('--cache-ttl', type=int, default=86400)
+    caching.add_argument('--cache-max-bytes', type=int, default=1024 ** 3)
+    caching.add_argument('--llm-cache-path', default='./Cache/llm_cache.sqlite')
+    caching.add_argument('--no-llm-cache', dest='use_llm_cache', action='store_false', default=True)
+
+    extraction = parser.add_argument_group('extraction')
+    extraction.add_argument('--prompt-token-budget', type=int, default=3000)
+    extraction.add_argument('--extraction-mode', choices=('json', 'delimited'), default='json')
+    extraction.add_argument('--no-structured-data', dest='use_structured_data', action='store_false', default=True)
+    extraction.add_argument('--relevance-backend', choices=('gpt', 'distilbert'), default='gpt')
+    extraction.add_argument('--relevance-model-path')
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--journal-dir', default='./Cache/journals')
+    run.add_argument('--resume', action='store_true', default=False, help="Skip URLs done by a previous run")
+    run.add_argument('--metrics-dir')
+    run.add_argument('--metrics-interval', type=float, default=10)
+    return parser
+
+
+def parse_args(argv=None):
+    """Command line arguments on top of the config file given with --config."""
+    parser = build_parser()
+    args, _ = parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = set(config) - set(CONFIG_KEYS)
+        if unknown:
+            parser.error(f"Unknown settings in {args.config}: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+    args = parser.parse_args(argv)
+
+    # Positional CSV files replace the config file's list when given
+    if not args.csv_files and args.config:
+        args.csv_files = config.get('csv_files', [])
+    if isinstance(args.csv_files, str):
+        args.csv_files = [args.csv_files]
+    args.csv_files = expand_csv_files(args.csv_files)
+    if not args.csv_files:
+        parser.error("No CSV files to process")
+    if not args.identifier:
+        parser.error("--identifier is required")
+    if args.api_key_env not in os.environ:
+        parser.error(f"Environment variable {args.api_key_env} is not set")
+    return args
+
+
+def stop_on_signals(stop_event):
+    """SIGINT and SIGTERM cancel the run the way the GUI's Cancel button does, so finished rows are still written."""
+    received = []
+
+    def handler(signum, frame):
+        received.append(signum)
+        print(f"Received {signal.Signals(signum).name}, stopping after the pages in progress...")
+        stop_event.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, handler)
+    return received
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stop_event = threading.Event()
+    received = stop_on_signals(stop_event)
+
+    try:
+        extractor = EventExtractor(args.api_key_env, args.csv_files, load_column_mapping(args.column_mapping),
+                                   args.identifier, args.output_dir, parse_num_rows(args.num_rows),
+                                   fetch_concurrency=args.fetch_concurrency,
+                                   per_host_concurrency=args.per_host_concurrency, http2=args.http2,
+                                   cache_dir=args.cache_dir, cache_ttl=args.cache_ttl,
+                                   cache_max_bytes=args.cache_max_bytes, llm_workers=args.llm_workers,
+                                   llm_cache_path=args.llm_cache_path, use_llm_cache=args.use_llm_cache,
+                                   prompt_token_budget=args.prompt_token_budget,
+                                   relevance_backend=args.relevance_backend,
+                                   relevance_model_path=args.relevance_model_path,
+                                   extraction_mode=args.extraction_mode, journal_dir=args.journal_dir,
+                                   resume=args.resume, use_structured_data=args.use_structured_data,
+                                   parse_workers=args.parse_workers,
+                                   stage_workers=parse_stage_workers(args.stage_workers),
+                                   stage_queue_size=args.stage_queue_size, metrics_dir=args.metrics_dir,
+                                   metrics_interval=args.metrics_interval or None)
+        extractor.run(stop_event)
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+    if received:
+        # A cancelled run kept its rows in the journal, rerun with --resume to finish it
+        return 128 + received[0]
+    print(f"Output file: {extractor.get_output_file()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
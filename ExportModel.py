@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from RelevanceBackend import INT8_WEIGHTS, ONNX_MODEL, FORMAT_FILE, quantize_dynamic_int8
+
+
+def export_int8(model, output_dir):
+    """Saves an INT8 state dict next to the fp32 config, RelevanceBackend re-quantizes the config and loads it."""
+    model.config.save_pretrained(output_dir)
+    torch.save(quantize_dynamic_int8(model).state_dict(), os.path.join(output_dir, INT8_WEIGHTS))
+
+
+def export_onnx(model, tokenizer, output_dir, quantize=False):
+    """Exports the model to ONNX with dynamic batch and sequence axes, optionally quantized to INT8 by ONNX Runtime."""
+    sample = tokenizer(["An example event description"], return_tensors="pt")
+    onnx_path = os.path.join(output_dir, ONNX_MODEL)
+    model.config.return_dict = False
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                      "attention_mask": {0: "batch", 1: "sequence"},
+                      "logits": {0: "batch"}},
+        opset_version=14,
+    )
+    model.config.return_dict = True
+    model.config.save_pretrained(output_dir)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+        os.replace(onnx_path, fp32_path)
+        quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a Train.py checkpoint as an INT8 and/or ONNX model.")
+    parser.add_argument('checkpoint', help="Checkpoint directory saved by Train.py")
+    parser.add_argument('--format', choices=('int8', 'onnx', 'onnx-int8'), default='int8',
+                        help="int8: PyTorch dynamic quantization, onnx: ONNX Runtime, onnx-int8: quantized ONNX")
+    parser.add_argument('--output', help="Output directory, defaults to <checkpoint>_<format>")
+    args = parser.parse_args()
+
+    output_dir = args.output or f"{args.checkpoint.rstrip('/')}_{args.format}"
+    os.makedirs(output_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.checkpoint)
+    model = AutoModelForSequenceClassification.from_pretrained(args.checkpoint)
+    model.eval()
+
+    if args.format == 'int8':
+        export_int8(model, output_dir)
+    else:
+        export_onnx(model, tokenizer, output_dir, quantize=args.format == 'onnx-int8')
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, FORMAT_FILE), 'w') as f:
+        json.dump({'format': args.format, 'source': os.path.abspath(args.checkpoint)}, f)
+
+    print(f"Exported {args.checkpoint} as {args.format} to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from lxml import etree
+
+from ContentExtractor import parse_html, text_lines, drop_elements
+
+# Elements whose strings BeautifulSoup's get_text leaves out, unlike ContentExtractor it keeps <noscript> text
+GET_TEXT_SKIPPED_TAGS = ('script', 'style', 'template')
+
+EVENTBRITE_XPATHS = {
+    'title': '//h1[@class="event-title css-0"]',
+    'start_time': '//meta[@property="event:start_time"]/@content',
+    'end_time': '//meta[@property="event:end_time"]/@content',
+    'location': '//meta[@name="twitter:data1"]/@value',
+    'description': '//div[contains(concat(" ", normalize-space(@class), " "), " has-user-generated-content ")]',
+    'organizer': '//a[contains(concat(" ", normalize-space(@class), " "), " descriptive-organizer-info__name-link ")]'
+                 '/@href',
+}
+
+
+def body_text(html_content):
+    """lxml equivalent of BeautifulSoup(html_content, "lxml").body.get_text(separator="\\n", strip=True)."""
+    root = parse_html(html_content)
+    body = root.find('body') if root is not None else None
+    if body is None:
+        return ""
+    drop_elements(list(body.iter(etree.Comment, *GET_TEXT_SKIPPED_TAGS)))
+    return '\n'.join(text_lines(body))
+
+
+def element_text(element):
+    """All text under element as BeautifulSoup's get_text() returns it: unstripped, without comments or scripts."""
+    drop_elements(list(element.iter(etree.Comment, *GET_TEXT_SKIPPED_TAGS)))
+    return ''.join(element.itertext())
+
+
+def first_match(root, field):
+    """First node the xpath of an Eventbrite field selects, ValueError when the page does not have it."""
+    found = root.xpath(EVENTBRITE_XPATHS[field])
+    if not found:
+        raise ValueError(f"Eventbrite page has no {field}")
+    return found[0]
+
+
+def eventbrite_fields(html_content):
+    """
+    Reads an Eventbrite page with lxml xpath lookups. Returns the same row as the former BeautifulSoup parser:
+    title, start and end time, location, description and organizer link. Raises ValueError when a field is missing.
+    """
+    root = parse_html(html_content)
+    if root is None:
+        raise ValueError("Eventbrite page could not be parsed")
+
+    start_time = datetime.fromisoformat(first_match(root, 'start_time').replace("Z", "+00:00"))
+    end_time = datetime.fromisoformat(first_match(root, 'end_time').replace("Z", "+00:00"))
+
+    return [element_text(first_match(root, 'title')), start_time.strftime('%B %d, %Y, %I:%M %p'),
+            end_time.strftime('%B %d, %Y, %I:%M %p'), str(first_match(root, 'location')),
+            element_text(first_match(root, 'description')), str(first_match(root, 'organizer'))]
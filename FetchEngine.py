@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from HTTPClient import HTTPClient, REQUEST_ERRORS
+from RateLimiter import THROTTLE_STATUSES
+
+
+class FetchEngine:
+    """Fetches URLs concurrently on an asyncio event loop and hands the responses back in input order."""
+
+    def __init__(self, fetch_func, max_concurrency=16, per_host_concurrency=4, max_attempts=10, retry_delay=5,
+                 rate_limiter=None, error_logger=None):
+        """
+        Parameters:
+            fetch_func (callable): Blocking function taking a URL and returning a response.
+            max_concurrency (int): Maximum number of requests in flight across all hosts.
+            per_host_concurrency (int): Maximum number of requests in flight against a single host.
+            max_attempts (int): Number of attempts per URL before giving up on it.
+            retry_delay (float): Seconds to wait between two attempts on the same URL when there is no rate limiter.
+            rate_limiter (DomainRateLimiter): Limiter used by fetch_func, waited on here before taking a global slot.
+            error_logger (logging.Logger): Logger receiving fetch errors.
+        """
+        self.fetch_func = fetch_func
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.per_host_concurrency = max(1, int(per_host_concurrency))
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.rate_limiter = rate_limiter
+        self.error_logger = error_logger
+
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._global_semaphore = None
+        self._host_semaphores = {}
+
+    def _log_error(self, message):
+        if self.error_logger:
+            self.error_logger.error(message)
+
+    def _start(self):
+        """Starts the event loop on a background thread with its own pool for the blocking fetches."""
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='fetch')
+        self._loop.set_default_executor(self._executor)
+        self._global_semaphore = None
+        self._host_semaphores = {}
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fetch-loop', daemon=True)
+        self._thread.start()
+
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _stop(self):
+        """Cancels whatever is still in flight and tears the loop down."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        # Blocking fetches that are already running cannot be interrupted, so do not wait on them
+        self._executor.shutdown(wait=False)
+        self._loop = None
+
+    @staticmethod
+    async def _sleep(seconds, stop_event):
+        """Sleeps in short slices so a long back-off does not hold up a cancelled run."""
+        deadline = time.monotonic() + seconds
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(min(1.0, deadline - time.monotonic()))
+
+    async def _fetch(self, url, stop_event):
+        """Fetches a single URL with retries, returns None if every attempt failed or the run was stopped."""
+        # Semaphores are created here so that they belong to the fetch loop
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        host = HTTPClient.host(url)
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+
+        # Take the host slot first so a busy host does not hold on to global slots while it waits
+        async with self._host_semaphores[host]:
+            for attempt in range(1, self.max_attempts + 1):
+                if self.rate_limiter:
+                    # Wait out the host's pacing and back-off here rather than in a fetch thread
+                    await self._sleep(self.rate_limiter.delay(host), stop_event)
+                if stop_event.is_set():
+                    return None
+
+                async with self._global_semaphore:
+                    try:
+                        response = await self._loop.run_in_executor(None, self.fetch_func, url)
+                    except REQUEST_ERRORS as e:
+                        response = None
+                        print(f"Error fetching {url}, retrying...")
+                        self._log_error(f"Error fetching {url}. Error: {str(e)}")
+                    except Exception as e:
+                        # Anything else is a bug or a page we cannot handle, retrying would fail the same way. It
+                        # only costs this URL, not the run
+                        print(f"Unexpected error fetching {url}, moving to next URL.")
+                        self._log_error(f"Unexpected error fetching {url}. Error: {type(e).__name__}: {str(e)}")
+                        return None
+
+                if response is not None:
+                    if response.status_code not in THROTTLE_STATUSES:
+                        return response
+                    print(f"{url} is being throttled (HTTP {response.status_code}), retrying...")
+                    self._log_error(f"Throttled fetching {url}. Status: {response.status_code}")
+
+                if self.rate_limiter is None and attempt < self.max_attempts:
+                    await self._sleep(self.retry_delay, stop_event)
+
+        print(f"Failed to fetch {url} after {self.max_attempts} attempts, moving to next URL.")
+        self._log_error(f"Failure fetching {url}.")
+        return None
+
+    def fetch_in_order(self, urls, stop_event, prefetch=None):
+        """
+        Generator yielding (url, response) pairs in the same order as urls while later URLs are fetched in the
+        background. The response is None when the URL could not be fetched.
+
+        Parameters:
+            urls (iterable[str]): URLs to fetch. A generator filled as the run goes on may yield None when it has no
+                URL at the moment: the URLs in flight are handed back first, and it is asked again once there are
+                none left.
+            stop_event (threading.Event): Stops the generator and cancels outstanding fetches once set.
+            prefetch (int): How many URLs may be scheduled ahead of the consumer, defaults to 4x max_concurrency.
+        """
+        window = prefetch or self.max_concurrency * 4
+        pending = deque()
+        url_iter = iter(urls)
+        exhausted = False
+        waiting = False
+
+        self._start()
+        try:
+            while True:
+                while not exhausted and not waiting and len(pending) < window and not stop_event.is_set():
+                    try:
+                        url = next(url_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if url is None:
+                        waiting = True
+                        break
+                    future = asyncio.run_coroutine_threadsafe(self._fetch(url, stop_event), self._loop)
+                    pending.append((url, future))
+
+                if stop_event.is_set():
+                    break
+                if not pending:
+                    if exhausted:
+                        break
+                    # The source had nothing left to fetch, ask it again now that everything in flight is handed back
+                    waiting = False
+                    continue
+
+                url, future = pending.popleft()
+                response = future.result()
+                if stop_event.is_set():
+                    break
+                yield url, response
+        finally:
+            for _, future in pending:
+                future.cancel()
+            self._stop()
@@ -0,0 +1,122 @@
+import argparse
+import time
+from datetime import datetime
+
+import requests
+from bs4 import BeautifulSoup
+
+from ContentExtractor import decode_html
+from FastHTML import body_text, eventbrite_fields
+from PageCache import PageCache
+
+CACHE_DIR = "./Cache/pages"
+
+CHARSET_TEXT = "Café – Zürich, 3 März"
+CHARSET_EVENTBRITE_PAGE = f"""<html><head>
+<meta property="event:start_time" content="2030-03-03T10:00:00Z">
+<meta property="event:end_time" content="2030-03-03T12:00:00Z">
+<meta name="twitter:data1" value="{CHARSET_TEXT}">
+</head><body><h1 class="event-title css-0">{CHARSET_TEXT}</h1>
+<div class="event-details has-user-generated-content"><p>{CHARSET_TEXT}</p></div>
+<a class="descriptive-organizer-info__name-link" href="https://www.eventbrite.com/o/1">Organizer</a></body></html>"""
+
+# Pages whose charset only the Content-Type header tells, always part of the comparison since cached pages rarely
+# cover them: lxml alone would read their bytes as Latin-1
+CHARSET_PAGES = [
+    ('header-charset/eventbrite/utf-8', CHARSET_EVENTBRITE_PAGE.encode('utf-8'), 'text/html; charset=UTF-8'),
+    ('header-charset/eventbrite/windows-1252', CHARSET_EVENTBRITE_PAGE.encode('windows-1252'),
+     'text/html; charset=windows-1252'),
+]
+
+
+def bs_body_text(html_content):
+    """The BeautifulSoup body text extraction EventExtractor used before FastHTML."""
+    soup = BeautifulSoup(html_content, "lxml")
+    body = soup.body
+    return body.get_text(separator="\n", strip=True) if body else ""
+
+
+def bs_eventbrite_fields(html_content):
+    """The BeautifulSoup Eventbrite parser EventExtractor used before FastHTML."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    h1 = soup.find('h1', class_='event-title css-0')
+    start_time_meta = soup.find('meta', property=lambda x: x == 'event:start_time' if x else False)
+    start_time = datetime.fromisoformat(start_time_meta['content'].replace("Z", "+00:00"))
+
+    end_time_meta = soup.find('meta', property=lambda x: x == 'event:end_time' if x else False)
+    end_time = datetime.fromisoformat(end_time_meta['content'].replace("Z", "+00:00"))
+
+    location = soup.find('meta', attrs={'name': 'twitter:data1'})['value']
+    description = soup.find('div', class_='has-user-generated-content')
+    organizer = soup.find('a', class_='descriptive-organizer-info__name-link')
+
+    return [h1.get_text(), start_time.strftime('%B %d, %Y, %I:%M %p'),
+            end_time.strftime('%B %d, %Y, %I:%M %p'), location, description.get_text(), organizer['href']]
+
+
+def reference_html(content, content_type):
+    """The page as the BeautifulSoup code got it: requests' response.text when the header has a charset."""
+    encoding = requests.utils.get_encoding_from_headers({'content-type': content_type or ''})
+    if encoding and 'charset' in (content_type or '').lower():
+        return content.decode(encoding, errors='replace')
+    return content
+
+
+def timed(func, html_content):
+    """Returns (result, seconds), the result is None when func raised."""
+    start = time.perf_counter()
+    try:
+        result = func(html_content)
+    except Exception:
+        result = None
+    return result, time.perf_counter() - start
+
+
+def compare(name, reference, fast, pages):
+    """Runs both implementations over pages, prints their throughput and returns the URLs whose output differs."""
+    reference_time = fast_time = 0.0
+    mismatches = []
+    for url, content, content_type in pages:
+        # Decoding is part of both timings, each side decodes the way its code path does
+        expected, seconds = timed(lambda page: reference(reference_html(page, content_type)), content)
+        reference_time += seconds
+        actual, seconds = timed(lambda page: fast(decode_html(page, content_type)), content)
+        fast_time += seconds
+        if expected != actual:
+            mismatches.append(url)
+
+    if not pages:
+        print(f"{name}: no pages")
+        return mismatches
+    print(f"{name}: {len(pages)} pages, BeautifulSoup {len(pages) / reference_time:.1f} pages/sec, "
+          f"lxml {len(pages) / fast_time:.1f} pages/sec ({reference_time / fast_time:.1f}x), "
+          f"{len(mismatches)} outputs differ")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BeautifulSoup and lxml HTML handling on the cached pages.")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Page cache written by EventExtractor")
+    parser.add_argument('--limit', type=int, help="Number of pages to use, all when omitted")
+    args = parser.parse_args()
+
+    cache = PageCache(args.cache_dir)
+    pages = []
+    for page in cache.iter_pages():
+        if args.limit and len(pages) >= args.limit:
+            break
+        pages.append(page)
+    cache.close()
+    pages += CHARSET_PAGES
+
+    mismatches = compare("Body text", bs_body_text, body_text, pages)
+    mismatches += compare("Eventbrite fields", bs_eventbrite_fields, eventbrite_fields,
+                          [page for page in pages if 'eventbrite' in page[0]])
+
+    for url in mismatches[:20]:
+        print(f"Differs: {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Optional extras: brotli lets us accept "br" encoded bodies, httpx + h2 enables HTTP/2
+try:
+    import brotli  # noqa: F401
+    BROTLI_AVAILABLE = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        BROTLI_AVAILABLE = True
+    except ImportError:
+        BROTLI_AVAILABLE = False
+
+try:
+    import httpx
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTP2_AVAILABLE = False
+
+# Exceptions a caller should treat as a failed request, whichever transport is in use
+REQUEST_ERRORS = (requests.exceptions.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+# A locked or corrupt cache index, or a full disk: the page cache is then skipped, never the page
+CACHE_ERRORS = (sqlite3.Error, OSError)
+
+ACCEPT_ENCODING = "gzip, deflate, br" if BROTLI_AVAILABLE else "gzip, deflate"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept-Encoding": ACCEPT_ENCODING,
+}
+
+
+class DNSCache:
+    """Caches socket.getaddrinfo results for a fixed time so repeated requests to a host skip the lookup."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._original_getaddrinfo = None
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        # Failed lookups raise and are therefore never cached
+        result = self._original_getaddrinfo(*args, **kwargs)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        """Routes every lookup in this process through the cache."""
+        if self._original_getaddrinfo is None:
+            self._original_getaddrinfo = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+
+
+def install_dns_cache(ttl=300):
+    """Installs the process wide DNS cache once and returns it."""
+    global _dns_cache
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DNSCache(ttl)
+            _dns_cache.install()
+    return _dns_cache
+
+
+class HTTPClient:
+    """Keep-alive HTTP client shared by the extractor and the URL collectors."""
+
+    def __init__(self, pool_connections=32, pool_maxsize=16, http2=False, dns_ttl=300, headers=None, cache=None,
+                 rate_limiter=None, error_logger=None):
+        """
+        Parameters:
+            pool_connections (int): Number of hosts whose connection pools are kept around.
+            pool_maxsize (int): Number of keep-alive connections kept per host.
+            http2 (bool): Use HTTP/2 when httpx and h2 are installed, falls back to HTTP/1.1 otherwise.
+            dns_ttl (int): Seconds a DNS answer is reused for, 0 disables the DNS cache.
+            headers (dict): Headers sent with every request, on top of DEFAULT_HEADERS.
+            cache (PageCache): On-disk page cache consulted before the network, None to always fetch.
+            rate_limiter (DomainRateLimiter): Paces network requests per host, cache hits are not paced.
+            error_logger (logging.Logger): Logger receiving page cache errors.
+        """
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.error_logger = error_logger
+
+        if dns_ttl:
+            install_dns_cache(dns_ttl)
+
+        if http2 and not HTTP2_AVAILABLE:
+            print("HTTP/2 requested but httpx[http2] is not installed, falling back to HTTP/1.1.")
+        self.http2 = http2 and HTTP2_AVAILABLE
+
+        if self.http2:
+            limits = httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                  max_keepalive_connections=pool_maxsize)
+            self.session = httpx.Client(http2=True, limits=limits, headers=self.headers, follow_redirects=True)
+        else:
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+    @staticmethod
+    def host(url):
+        """Returns the host part of a URL."""
+        return urlparse(url).netloc.lower()
+
+    def _send(self, url, headers, timeout, **kwargs):
+        """Sends a request over the network, paced and adapted by the rate limiter."""
+        if self.rate_limiter is None:
+            return self.session.get(url, headers=headers, timeout=timeout, **kwargs)
+
+        host = self.host(url)
+        self.rate_limiter.acquire(host)
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout, **kwargs)
+        except REQUEST_ERRORS:
+            self.rate_limiter.penalize(host)
+            raise
+        self.rate_limiter.update(host, response.status_code, response.headers)
+        return response
+
+    def _log_cache_error(self, action, url, error):
+        print(f"Page cache error {action} {url}, continuing without the cache.")
+        if self.error_logger:
+            self.error_logger.error(f"Page cache error {action} {url}. Error: {str(error)}")
+
+    def get(self, url, headers=None, timeout=15, **kwargs):
+        """
+        Sends a GET request over the pooled connections, going through the page cache when one is set. A failing
+        cache never fails the request: lookups count as misses and the response is not stored.
+        """
+        if self.cache is None:
+            return self._send(url, headers, timeout, **kwargs)
+
+        try:
+            cached_response, entry = self.cache.lookup(url)
+        except CACHE_ERRORS as e:
+            self._log_cache_error('reading', url, e)
+            self.cache.misses += 1
+            cached_response, entry = None, None
+        if cached_response is not None:
+            return cached_response
+
+        # A stale entry turns the request into a conditional one
+        request_headers = dict(headers or {}, **self.cache.conditional_headers(entry))
+        response = self._send(url, request_headers, timeout, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            try:
+                cached_response = self.cache.revalidate(url, entry, response)
+            except CACHE_ERRORS as e:
+                self._log_cache_error('revalidating', url, e)
+                cached_response = None
+            if cached_response is not None:
+                return cached_response
+            # The cached body could not be read, so the page is fetched again without validators
+            response = self._send(url, headers, timeout, **kwargs)
+        try:
+            self.cache.store(url, response)
+        except CACHE_ERRORS as e:
+            self._log_cache_error('writing', url, e)
+        return response
+
+    def close(self):
+        """Closes every pooled connection."""
+        self.session.close()
+
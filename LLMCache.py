@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LLMCache:
+    """SQLite memo store of chat completions keyed by a hash of the model, system message and normalized prompt."""
+
+    def __init__(self, path, max_entries=100000, enabled=True):
+        """
+        Parameters:
+            path (str): SQLite file holding the completions.
+            max_entries (int): Number of completions kept, the least recently used ones are evicted beyond it.
+            enabled (bool): False bypasses the cache entirely, nothing is read or written.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not enabled:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)')
+        self._db.commit()
+        self._entries = self._db.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+    @staticmethod
+    def make_key(model, system_message, prompt, extra=None):
+        """Hashes a request, whitespace in the prompt is collapsed so indentation changes do not miss the cache."""
+        normalized_prompt = ' '.join(prompt.split())
+        payload = json.dumps([model, system_message, normalized_prompt, extra], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached completion for key, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT content FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE completions SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, content):
+        """Stores a completion, replacing any previous one for the same key."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            existed = self._db.execute('SELECT 1 FROM completions WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)',
+                             (key, model, content, now, now))
+            if not existed:
+                self._entries += 1
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Drops the least recently used completions beyond max_entries. Caller holds the lock."""
+        excess = self._entries - self.max_entries
+        if not self.max_entries or excess <= 0:
+            return
+        self._db.execute('DELETE FROM completions WHERE key IN '
+                         '(SELECT key FROM completions ORDER BY accessed_at LIMIT ?)', (excess,))
+        self._entries -= excess
+        self.evictions += excess
+
+    def stats(self):
+        """Returns the hit / miss counters of this cache."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        if self.enabled:
+            with self._lock:
+                self._db.close()
@@ -0,0 +1,186 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+PROMETHEUS_PREFIX = "event_extractor_"
+
+
+def label_key(labels):
+    """Hashable, ordered form of a label dict."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def prometheus_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values, the way Prometheus histograms keep them."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, an estimate good enough to spot regressions."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Thread safe counters, gauges and latency histograms of a run, exported as JSON or a Prometheus textfile."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+
+    def inc(self, name, value=1, **labels):
+        """Adds value to the counter name with the given labels."""
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        """Records value, in seconds for latencies, in the histogram name with the given labels."""
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the time spent in the with block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """All metrics as plain JSON serializable data."""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(key), 'value': value}
+                        for (name, key), value in sorted(self.counters.items())]
+            gauges = [{'name': name, 'labels': dict(key), 'value': value}
+                      for (name, key), value in sorted(self.gauges.items())]
+            histograms = [{'name': name, 'labels': dict(key), 'count': histogram.count, 'sum': histogram.sum,
+                           'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95),
+                           'buckets': {('+Inf' if math.isinf(bound) else str(bound)): count
+                                       for bound, count in zip(histogram.buckets, histogram.counts)}}
+                          for (name, key), histogram in sorted(self.histograms.items())]
+        return {'timestamp': time.time(), 'uptime': time.time() - self.start_time, 'counters': counters,
+                'gauges': gauges, 'histograms': histograms}
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}")
+                    for (metric_name, key), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(f"{PROMETHEUS_PREFIX}{name}{prometheus_labels(key)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} histogram")
+                for (metric_name, key), histogram in sorted(self.histograms.items()):
+                    if metric_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        le = '+Inf' if math.isinf(bound) else str(bound)
+                        lines.append(f"{PROMETHEUS_PREFIX}{name}_bucket{prometheus_labels(key, [('le', le)])} {count}")
+                    lines.append(f"{PROMETHEUS_PREFIX}{name}_sum{prometheus_labels(key)} {histogram.sum}")
+                    lines.append(f"{PROMETHEUS_PREFIX}{name}_count{prometheus_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path, text):
+        """Writes through a temporary file so readers such as node_exporter never see a half written file."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def write(self, json_path=None, prometheus_path=None):
+        if json_path:
+            self._write_atomic(json_path, json.dumps(self.snapshot(), indent=2))
+        if prometheus_path:
+            self._write_atomic(prometheus_path, self.prometheus())
+
+
+class MetricsReporter:
+    """Rewrites the JSON snapshot and Prometheus textfile of a Metrics object every few seconds on a thread."""
+
+    def __init__(self, metrics, json_path=None, prometheus_path=None, interval=10, refresh=None):
+        """
+        Parameters:
+            metrics (Metrics): Metrics to export.
+            json_path (str): JSON snapshot file, None to skip it.
+            prometheus_path (str): Prometheus textfile, None to skip it.
+            interval (float): Seconds between two writes.
+            refresh (callable): Called before every write, to update gauges such as queue depths.
+        """
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.refresh = refresh
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        if self.refresh is not None:
+            self.refresh()
+        self.metrics.write(self.json_path, self.prometheus_path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write metrics: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the thread and writes the final numbers."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
@@ -0,0 +1,268 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+# Raised reading a body that was removed, truncated or corrupted behind our back
+BLOB_ERRORS = (OSError, EOFError, zlib.error)
+
+
+class CachedResponse:
+    """Minimal stand-in for an HTTP response that was served from the page cache."""
+
+    from_cache = True
+
+    def __init__(self, url, status_code, headers, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if 400 <= self.status_code:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class PageCache:
+    """
+    Content-addressed, gzip compressed on-disk cache of fetched pages.
+
+    Page bodies are stored once per content hash under objects/, the SQLite index maps cache keys to bodies and
+    keeps the validators (ETag / Last-Modified) needed to revalidate stale entries. Entries older than ttl are
+    revalidated, and the least recently used entries are evicted once the bodies exceed max_bytes.
+    """
+
+    def __init__(self, cache_dir, ttl=86400, max_bytes=1024 ** 3, key_func=None):
+        """
+        Parameters:
+            cache_dir (str): Directory holding the index and the compressed bodies.
+            ttl (float): Seconds an entry is served without revalidation, None to never revalidate.
+            max_bytes (int): Size of the compressed bodies above which the least recently used entries are evicted.
+            key_func (callable): Maps a URL to its cache key, the URL itself by default.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.key_func = key_func or (lambda url: url)
+
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                digest TEXT,
+                size INTEGER,
+                status INTEGER,
+                headers TEXT,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL
+            )""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)')
+        self._db.commit()
+        self._total_bytes = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM pages GROUP BY digest)').fetchone()[0]
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest + '.gz')
+
+    def _read_blob(self, digest):
+        with open(self._blob_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def _write_blob(self, digest, content):
+        """Writes a body unless the same content is already stored, returns the number of new bytes."""
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = gzip.compress(content)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(temp_path, path)
+        return len(compressed)
+
+    def lookup(self, url):
+        """
+        Returns (response, entry) for a cached URL, or (None, None) when it is not cached. The response is only
+        set when the entry is still fresh, otherwise the entry carries the validators for a conditional request.
+        """
+        key = self.key_func(url)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, status, headers, encoding, etag, last_modified, fetched_at FROM pages WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None, None
+
+        entry = dict(zip(('digest', 'status', 'headers', 'encoding', 'etag', 'last_modified', 'fetched_at'), row))
+        if self.ttl is not None and time.time() - entry['fetched_at'] > self.ttl:
+            self.stale += 1
+            return None, entry
+
+        try:
+            response = self._response(url, entry)
+        except BLOB_ERRORS:
+            self._discard(entry['digest'])
+            self.misses += 1
+            return None, None
+        self._touch(key)
+        self.hits += 1
+        return response, entry
+
+    def conditional_headers(self, entry):
+        """Headers turning a request for a stale entry into a revalidation."""
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def revalidate(self, url, entry, not_modified_response):
+        """
+        Marks a stale entry fresh again after a 304 and returns the cached response, or None when its body can no
+        longer be read: the entry is then dropped and the page has to be fetched again.
+        """
+        try:
+            response = self._response(url, entry)
+        except BLOB_ERRORS:
+            self._discard(entry['digest'])
+            self.misses += 1
+            return None
+        key = self.key_func(url)
+        etag = not_modified_response.headers.get('ETag') or entry['etag']
+        last_modified = not_modified_response.headers.get('Last-Modified') or entry['last_modified']
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE pages SET etag = ?, last_modified = ?, fetched_at = ?, accessed_at = ? WHERE key = ?',
+                (etag, last_modified, now, now, key))
+            self._db.commit()
+        self.revalidated += 1
+        return response
+
+    def store(self, url, response):
+        """Stores a successful response."""
+        if response.status_code != 200:
+            return
+        key = self.key_func(url)
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() in ('content-type', 'etag', 'last-modified')}
+        now = time.time()
+
+        with self._lock:
+            added = self._write_blob(digest, content)
+            if added:
+                size = added
+            else:
+                row = self._db.execute('SELECT size FROM pages WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+                size = row[0] if row else os.path.getsize(self._blob_path(digest))
+            previous = self._db.execute('SELECT digest FROM pages WHERE key = ?', (key,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, digest, size, response.status_code, json.dumps(headers), response.encoding,
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now))
+            self._total_bytes += added
+            if previous and previous[0] != digest:
+                self._drop_unreferenced(previous[0])
+            self._evict()
+            self._db.commit()
+
+    def _response(self, url, entry):
+        return CachedResponse(url, entry['status'], json.loads(entry['headers']), self._read_blob(entry['digest']),
+                              entry['encoding'])
+
+    def _touch(self, key):
+        with self._lock:
+            self._db.execute('UPDATE pages SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+
+    def _discard(self, digest):
+        """Drops the entries of an unreadable body, and the body, so the next store writes it again."""
+        with self._lock:
+            # The recorded size, the file on disk may be truncated or gone
+            size = self._db.execute('SELECT MAX(size) FROM pages WHERE digest = ?', (digest,)).fetchone()[0]
+            self._db.execute('DELETE FROM pages WHERE digest = ?', (digest,))
+            self._db.commit()
+            self._total_bytes -= size or 0
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def _drop_unreferenced(self, digest):
+        """Deletes a body once no key points at it anymore. Caller holds the lock."""
+        if self._db.execute('SELECT 1 FROM pages WHERE digest = ? LIMIT 1', (digest,)).fetchone():
+            return
+        path = self._blob_path(digest)
+        try:
+            self._total_bytes -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Evicts least recently used entries until the bodies fit in max_bytes. Caller holds the lock."""
+        while self.max_bytes and self._total_bytes > self.max_bytes:
+            rows = self._db.execute('SELECT key, digest FROM pages ORDER BY accessed_at LIMIT 64').fetchall()
+            if not rows:
+                break
+            for key, digest in rows:
+                self._db.execute('DELETE FROM pages WHERE key = ?', (key,))
+                self._drop_unreferenced(digest)
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def iter_pages(self):
+        """
+        Yields (url, content, content_type) of every successfully fetched page in the cache, without touching their
+        LRU order.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT url, digest, headers FROM pages WHERE status = 200 ORDER BY fetched_at').fetchall()
+        for url, digest, headers in rows:
+            try:
+                content = self._read_blob(digest)
+            except BLOB_ERRORS:
+                continue
+            content_type = {name.lower(): value for name, value in json.loads(headers or '{}').items()}.get(
+                'content-type')
+            yield url, content, content_type
+
+    def stats(self):
+        """Returns the hit / miss counters of this cache."""
+        return {'hits': self.hits, 'stale': self.stale, 'revalidated': self.revalidated, 'misses': self.misses,
+                'evictions': self.evictions, 'bytes': self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
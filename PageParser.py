@@ -0,0 +1,81 @@
+import signal
+import time
+
+from ContentExtractor import ContentExtractor, decode_html
+from FastHTML import body_text, eventbrite_fields
+from StructuredData import StructuredDataExtractor
+
+# Site specific parsers, tried before the generic path for URLs containing the key
+SITE_PARSERS = {
+    'eventbrite': eventbrite_fields,
+    # You can add more here: 'someotherwebsite.com': someotherwebsite_fields,
+}
+
+# Parser of the current worker process, set up once by init_worker
+_worker_parser = None
+
+
+class PageParser:
+    """
+    The CPU bound part of processing a page: site parsers, structured data and the text handed to the LLM. Input is
+    the page bytes and their Content-Type, output a small dict of plain values so it can run in a worker process.
+    """
+
+    def __init__(self, column_mapping, prompt_token_budget=3000, use_structured_data=True):
+        """
+        Parameters:
+            column_mapping (dict): Output columns and their prompts.
+            prompt_token_budget (int): Token budget of the page text, None keeps the whole body text.
+            use_structured_data (bool): Reads schema.org / OpenGraph fields from the page.
+        """
+        self.column_count = len(column_mapping)
+        self.content_extractor = ContentExtractor(token_budget=prompt_token_budget) if prompt_token_budget else None
+        self.structured_data = StructuredDataExtractor(column_mapping) if use_structured_data else None
+
+    def page_text(self, html_content):
+        """Returns (text, stats) of a page, stats is None when the whole body text is kept."""
+        if self.content_extractor is None:
+            return body_text(html_content), None
+        return self.content_extractor.extract(html_content)
+
+    def parse(self, url, html_content, content_type=None):
+        """
+        Decodes the page with the charset of content_type (see decode_html) and returns a dict with the row of a site
+        parser ('site_row', or 'site_error' when it failed, and the parser's time in 'site_seconds'), the structured
+        data fields ('structured') and, only when the LLM will need it, the page text ('text', 'text_stats').
+        """
+        html_content = decode_html(html_content, content_type)
+        parsed = {'site_row': None, 'site_error': None, 'site_seconds': None, 'structured': {}, 'text': None,
+                  'text_stats': None}
+
+        site_parser = next((parser for domain, parser in SITE_PARSERS.items() if domain in url), None)
+        if site_parser is not None:
+            # Parsing is deterministic for a given page, so a failure is final rather than retried
+            start = time.perf_counter()
+            try:
+                parsed['site_row'] = site_parser(html_content)
+                return parsed
+            except Exception as e:
+                parsed['site_error'] = str(e)
+            finally:
+                parsed['site_seconds'] = time.perf_counter() - start
+
+        if self.structured_data is not None:
+            parsed['structured'] = self.structured_data.extract(html_content)
+        if len(parsed['structured']) < self.column_count:
+            parsed['text'], parsed['text_stats'] = self.page_text(html_content)
+        return parsed
+
+
+def init_worker(column_mapping, prompt_token_budget, use_structured_data):
+    """ProcessPoolExecutor initializer, builds the worker's parser once instead of pickling it with every page."""
+    global _worker_parser
+    # Ctrl-C and SIGTERM reach the whole process group, the main process decides when its workers stop
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_IGN)
+    _worker_parser = PageParser(column_mapping, prompt_token_budget, use_structured_data)
+
+
+def parse_in_worker(url, html_content, content_type=None):
+    """Module level, hence picklable, entry point of the worker processes."""
+    return _worker_parser.parse(url, html_content, content_type)
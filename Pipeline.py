@@ -0,0 +1,201 @@
+import queue
+import threading
+import time
+
+
+class Stage:
+    """One step of a Pipeline: a function run on every item by a fixed number of worker threads."""
+
+    def __init__(self, name, func, workers=1):
+        """
+        Parameters:
+            name (str): Name of the stage, also used to route items to it.
+            func (callable): Takes an item and returns None to pass it on to the next stage, or the name of the
+                stage it should go to instead. Items sent back to an earlier stage skip that stage's queue limit.
+            workers (int): Number of threads running func.
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+        self.processed = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded queues. A full queue blocks the stage feeding it, so a slow
+    stage holds back the ones before it instead of letting work pile up in memory.
+    """
+
+    def __init__(self, stages, queue_size=16, stop_event=None, error_logger=None, observer=None):
+        """
+        Parameters:
+            stages (list[Stage]): Stages in order, the output of the last one is collected by run().
+            queue_size (int): Capacity of the queue in front of every stage.
+            stop_event (threading.Event): Once set, items still waiting in a queue are dropped.
+            error_logger (logging.Logger): Logger receiving errors raised by stage functions.
+            observer (callable): Called with the stage name and seconds spent after every stage call.
+        """
+        self.stages = stages
+        self.index = {stage.name: position for position, stage in enumerate(stages)}
+        self.stop_event = stop_event or threading.Event()
+        self.error_logger = error_logger
+        self.observer = observer
+
+        self._queues = [queue.Queue(maxsize=max(1, int(queue_size))) for _ in stages]
+        self._retries = [queue.Queue() for _ in stages]
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._source_done = False
+        self._results = []
+        self._keep_results = True
+
+        self.source_name = 'source'
+        self.source_count = 0
+        self.source_wait = 0.0
+        self.start_time = None
+        self.dropped = 0
+
+    def busy(self):
+        """Whether items taken from the source are still in a queue or a stage."""
+        with self._lock:
+            return self._in_flight > 0
+
+    def depths(self):
+        """Number of items waiting in front of each stage."""
+        return {stage.name: self._queues[position].qsize() + self._retries[position].qsize()
+                for position, stage in enumerate(self.stages)}
+
+    def stats(self):
+        """Queue depth and throughput of every stage, the source included."""
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        depths = self.depths()
+        stats = {self.source_name: {'processed': self.source_count, 'busy_time': self.source_wait, 'workers': 1,
+                                    'queue_depth': 0, 'max_queue_depth': 0,
+                                    'per_second': self.source_count / elapsed if elapsed else 0.0,
+                                    # Share of the run spent producing items rather than blocked on a full queue
+                                    'utilization': self.source_wait / elapsed if elapsed else 0.0}}
+        for stage in self.stages:
+            stats[stage.name] = {
+                'processed': stage.processed, 'busy_time': stage.busy_time, 'workers': stage.workers,
+                'queue_depth': depths[stage.name], 'max_queue_depth': stage.max_depth,
+                'per_second': stage.processed / elapsed if elapsed else 0.0,
+                # Share of the stage's worker time spent working, close to 1 marks the bottleneck
+                'utilization': stage.busy_time / (elapsed * stage.workers) if elapsed else 0.0,
+            }
+        return stats
+
+    def _put(self, position, item, retry=False):
+        target = self._retries[position] if retry else self._queues[position]
+        while True:
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.stop_event.is_set():
+                    self._finish_item(dropped=True)
+                    return
+        stage = self.stages[position]
+        depth = self._queues[position].qsize() + self._retries[position].qsize()
+        if depth > stage.max_depth:
+            stage.max_depth = depth
+
+    def _get(self, position):
+        """Next item for a stage, sent back items first. None once the pipeline has nothing left in flight."""
+        while True:
+            try:
+                return self._retries[position].get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                return self._queues[position].get(timeout=0.05)
+            except queue.Empty:
+                with self._lock:
+                    if self._source_done and self._in_flight == 0:
+                        return None
+
+    def _finish_item(self, dropped=False):
+        with self._lock:
+            self._in_flight -= 1
+            if dropped:
+                self.dropped += 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    def _work(self, position):
+        stage = self.stages[position]
+        while True:
+            item = self._get(position)
+            if item is None:
+                return
+            if self.stop_event.is_set():
+                self._finish_item(dropped=True)
+                continue
+
+            start = time.perf_counter()
+            try:
+                route = stage.func(item)
+            except Exception as e:
+                # A stage that blows up loses the item, never the worker
+                if self.error_logger is not None:
+                    self.error_logger.error(f"Pipeline stage {stage.name} failed. Error: {str(e)}")
+                print(f"Pipeline stage {stage.name} failed: {e}")
+                self._finish_item(dropped=True)
+                continue
+            finally:
+                seconds = time.perf_counter() - start
+                with self._lock:
+                    stage.processed += 1
+                    stage.busy_time += seconds
+                if self.observer is not None:
+                    self.observer(stage.name, seconds)
+
+            target = position + 1 if route is None else self.index[route]
+            if target >= len(self.stages):
+                if self._keep_results:
+                    with self._lock:
+                        self._results.append(item)
+                self._finish_item()
+            else:
+                self._put(target, item, retry=target <= position)
+
+    def run(self, source, source_name='source', keep_results=True):
+        """
+        Feeds the items of source through the stages on the calling thread and returns the items that made it
+        through the last stage, in completion order. With keep_results False nothing is kept, for long running
+        sources whose last stage stores the items itself.
+        """
+        self.source_name = source_name
+        self._keep_results = keep_results
+        self.start_time = time.time()
+        threads = [threading.Thread(target=self._work, args=(position,), name=f"{stage.name}-{worker}", daemon=True)
+                   for position, stage in enumerate(self.stages) for worker in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            iterator = iter(source)
+            while not self.stop_event.is_set():
+                wait_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.source_wait += time.perf_counter() - wait_start
+                self.source_count += 1
+                with self._lock:
+                    self._in_flight += 1
+                self._put(0, item)
+        finally:
+            with self._lock:
+                self._source_done = True
+                while self._in_flight > 0:
+                    self._idle.wait(timeout=0.1)
+            for thread in threads:
+                thread.join()
+
+        return self._results
@@ -0,0 +1,174 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Statuses a server uses to tell us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+def retry_after_seconds(headers):
+    """Reads a Retry-After header given in seconds or as an HTTP date, returns None when absent or invalid."""
+    if not headers:
+        return None
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second. Callers hold the owning limiter's lock."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available, without taking them."""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def reserve(self, amount, now):
+        """Takes amount tokens, possibly going into debt, and returns how long the caller has to wait."""
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def set_rate(self, rate, now):
+        self._refill(now)
+        self.rate = rate
+
+
+class _HostState:
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.blocked_until = 0.0
+        self.failures = 0
+
+
+class DomainRateLimiter:
+    """
+    Per-domain token buckets whose rate adapts to the server: every throttling response (429 / 503) halves the
+    host's rate and honors its Retry-After header, every other response raises the rate a little again.
+    Connection errors back the host off exponentially.
+    """
+
+    def __init__(self, rate=10.0, burst=10, min_rate=0.2, max_rate=100.0, increase=0.5, decrease=0.5,
+                 max_backoff=60.0):
+        """
+        Parameters:
+            rate (float): Requests per second a host starts with.
+            burst (int): Requests a host may receive back to back.
+            min_rate (float): Lowest rate a throttling host is slowed down to.
+            max_rate (float): Highest rate a host is sped up to.
+            increase (float): Requests per second added after each successful response.
+            decrease (float): Factor applied to the rate after each throttling response.
+            max_backoff (float): Longest pause imposed after errors without a Retry-After header.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.rate, self.burst)
+        return self._hosts[host]
+
+    def delay(self, host):
+        """Seconds a request to host would currently have to wait, without reserving a slot."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host)
+            return max(state.bucket.wait_time(1, now), state.blocked_until - now)
+
+    def acquire(self, host):
+        """Blocks until a request to host is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host)
+            wait = max(state.bucket.reserve(1, now), state.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, host, status_code, headers=None):
+        """Adapts the host's rate to the status of the response it just sent."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host)
+            if status_code in THROTTLE_STATUSES:
+                state.bucket.set_rate(max(self.min_rate, state.bucket.rate * self.decrease), now)
+                state.failures += 1
+                retry_after = retry_after_seconds(headers)
+                pause = retry_after if retry_after is not None else self._backoff(state.failures)
+                state.blocked_until = max(state.blocked_until, now + pause)
+            else:
+                state.bucket.set_rate(min(self.max_rate, state.bucket.rate + self.increase), now)
+                state.failures = 0
+
+    def penalize(self, host):
+        """Backs a host off after a connection error or timeout."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(host)
+            state.failures += 1
+            state.blocked_until = max(state.blocked_until, now + self._backoff(state.failures))
+
+    def _backoff(self, failures):
+        return min(self.max_backoff, 2.0 ** (failures - 1))
+
+
+class OpenAIRateLimiter:
+    """Keeps OpenAI calls under a requests-per-minute and a tokens-per-minute limit and backs off on API errors."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_backoff=60.0):
+        # Buckets hold a tenth of a minute's budget so a burst cannot use up the whole minute at once
+        self.requests = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 10.0))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, max(1.0, tokens_per_minute / 10.0))
+        self.max_backoff = max_backoff
+        self.blocked_until = 0.0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """Blocks until a request using the given number of tokens is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now), self.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def settle(self, reserved_tokens, used_tokens):
+        """Corrects the token bucket once the API reported how many tokens a request actually used."""
+        with self._lock:
+            self.tokens.tokens -= used_tokens - reserved_tokens
+            self.failures = 0
+
+    def penalize(self, retry_after=None):
+        """Pauses every caller after an API error, for retry_after seconds if the API said so."""
+        with self._lock:
+            self.failures += 1
+            pause = retry_after if retry_after is not None else min(self.max_backoff, 2.0 ** self.failures)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
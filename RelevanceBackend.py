@@ -0,0 +1,157 @@
+import json
+import os
+import time
+
+# Columns the DistilBERT classifier was trained on, see Train.py
+RELEVANCE_TEXT_COLUMNS = ['Event Name', 'Description', 'Organizer']
+
+# Files written by ExportModel.py. FORMAT_FILE names the export format, the weight files tell apart exports made
+# before it was written
+INT8_WEIGHTS = "quantized_int8.pt"
+ONNX_MODEL = "model.onnx"
+FORMAT_FILE = "export_format.json"
+
+# ExportModel.py --format values and the runtime that loads each
+EXPORT_FORMATS = {'int8': 'int8', 'onnx': 'onnx', 'onnx-int8': 'onnx'}
+
+
+def checkpoint_format(model_path):
+    """'onnx', 'int8' or 'fp32' depending on what ExportModel.py (or Train.py) left in model_path."""
+    format_path = os.path.join(model_path, FORMAT_FILE)
+    if os.path.exists(format_path):
+        with open(format_path) as f:
+            export_format = json.load(f).get('format')
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {export_format!r} in {format_path}")
+        return EXPORT_FORMATS[export_format]
+    if os.path.exists(os.path.join(model_path, ONNX_MODEL)):
+        return 'onnx'
+    if os.path.exists(os.path.join(model_path, INT8_WEIGHTS)):
+        return 'int8'
+    return 'fp32'
+
+
+def quantize_dynamic_int8(model):
+    """Replaces the model's Linear layers with dynamically quantized INT8 ones."""
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def row_text(row, indices):
+    """Joins the given fields of an event row the way Train.py joins its training columns."""
+    return ' '.join(str(row[i]) if i < len(row) and row[i] is not None else '' for i in indices)
+
+
+class GPTRelevanceBackend:
+    """Checks relevance of the extracted events against a list of terms with GPT-4."""
+
+    name = 'gpt'
+
+    def __init__(self, extractor, terms):
+        self.extractor = extractor
+        self.terms = terms
+
+    def predict(self, rows):
+        """Returns one relevance value per row, None where it could not be determined."""
+        return self.extractor.check_relevance(rows, self.terms)
+
+
+class DistilBertRelevanceBackend:
+    """
+    Checks relevance with a DistilBERT checkpoint produced by Train.py, on the CPU and in batches. Checkpoints
+    exported by ExportModel.py are loaded as well: INT8 PyTorch weights, or an ONNX model run by ONNX Runtime.
+    """
+
+    name = 'distilbert'
+
+    def __init__(self, model_path, text_indices, batch_size=32, num_threads=None, max_length=512):
+        """
+        Parameters:
+            model_path (str): Checkpoint directory saved by Train.py or ExportModel.py.
+            text_indices (list[int]): Positions of the Event Name, Description and Organizer fields in a row.
+            batch_size (int): Number of rows per forward pass.
+            num_threads (int): Threads used for inference, all cores when None.
+            max_length (int): Rows are truncated to this many tokens.
+        """
+        # Imported here so the GPT backend works without the inference libraries installed
+        from transformers import AutoTokenizer
+
+        self.text_indices = text_indices
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.format = checkpoint_format(model_path)
+        num_threads = num_threads or os.cpu_count() or 1
+
+        load_start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if self.format == 'onnx':
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = num_threads
+            self.session = onnxruntime.InferenceSession(os.path.join(model_path, ONNX_MODEL), options,
+                                                        providers=['CPUExecutionProvider'])
+        else:
+            import torch
+            from transformers import AutoConfig, AutoModelForSequenceClassification
+
+            torch.set_num_threads(num_threads)
+            if self.format == 'int8':
+                # Rebuild the quantized architecture from the config, then load the INT8 weights into it
+                model = AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(model_path))
+                self.model = quantize_dynamic_int8(model)
+                self.model.load_state_dict(torch.load(os.path.join(model_path, INT8_WEIGHTS)))
+            else:
+                self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+            self.model.eval()
+        self.load_time = time.perf_counter() - load_start
+
+    def _probabilities(self, batch_texts):
+        """Class probabilities of a batch as a (rows, 2) numpy array."""
+        if self.format == 'onnx':
+            import numpy as np
+
+            inputs = self.tokenizer(batch_texts, truncation=True, max_length=self.max_length, padding='longest',
+                                    return_tensors="np")
+            logits = self.session.run(['logits'], {name: inputs[name].astype(np.int64)
+                                                   for name in ('input_ids', 'attention_mask')})[0]
+            exponentials = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+        import torch
+
+        inputs = self.tokenizer(batch_texts, truncation=True, max_length=self.max_length, padding='longest',
+                                return_tensors="pt")
+        with torch.inference_mode():
+            return torch.nn.functional.softmax(self.model(**inputs).logits, dim=-1).numpy()
+
+    def predict_texts(self, texts):
+        """
+        Returns (predictions, confidences, batch_latencies) for texts. Texts are sorted by length so each batch is
+        only padded to its own longest text, results come back in the order of texts.
+        """
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        predictions = [False] * len(texts)
+        confidences = [0.0] * len(texts)
+        batch_latencies = []
+
+        for start in range(0, len(order), self.batch_size):
+            batch_indices = order[start:start + self.batch_size]
+            batch_start = time.perf_counter()
+            probabilities = self._probabilities([texts[index] for index in batch_indices])
+            batch_latencies.append(time.perf_counter() - batch_start)
+
+            for index, row_probabilities in zip(batch_indices, probabilities):
+                prediction = int(row_probabilities.argmax())
+                predictions[index] = prediction == 1
+                confidences[index] = float(row_probabilities[prediction])
+
+        return predictions, confidences, batch_latencies
+
+    def predict(self, rows):
+        """Returns one relevance value per row."""
+        print("Starting the relevance check process...\n")
+        predictions, _, batch_latencies = self.predict_texts([row_text(row, self.text_indices) for row in rows])
+        print(f"Relevance check process completed: {len(rows)} rows in {sum(batch_latencies):.2f}s.")
+        return predictions
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import string
+import threading
+
+# Pages whose fetch failed are cheap to try again, so a resumed run does not skip them
+RETRY_ON_RESUME = ('fetch_error',)
+
+
+def journal_path(journal_dir, identifier, csv_files):
+    """Journal file of a run, derived from its identifier and CSV files so the same inputs find the same journal."""
+    whitelist = set(string.ascii_letters + string.digits + '_-')
+    sanitized = ''.join(c if c in whitelist else '_' for c in identifier.strip()) or 'run'
+    digest = hashlib.sha256('\n'.join(os.path.abspath(path) for path in csv_files).encode('utf-8')).hexdigest()
+    return os.path.join(journal_dir, f"{sanitized}_{digest[:12]}.jsonl")
+
+
+class RunJournal:
+    """Append-only JSONL record of the rows extracted so far, one line per URL, written as each URL completes."""
+
+    def __init__(self, path, resume=False):
+        """
+        Parameters:
+            path (str): JSONL file of the journal.
+            resume (bool): Keeps and loads an existing journal, otherwise the journal starts empty.
+        """
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if resume and os.path.exists(path):
+            self.entries = self._load(path)
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    @staticmethod
+    def _load(path):
+        """Reads the journal, later lines for a URL win and a line cut short by a crash is ignored."""
+        entries = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[entry['url']] = entry
+        return entries
+
+    def completed(self, url):
+        """Returns the journaled row of url when a resumed run can reuse it, else None."""
+        entry = self.entries.get(url)
+        if entry is None or entry.get('status') in RETRY_ON_RESUME:
+            return None
+        return entry['row']
+
+    def record(self, url, row, status='ok'):
+        """Appends the row extracted for url. Flushed right away so a crash loses at most the line being written."""
+        entry = {'url': url, 'status': status, 'row': row}
+        line = json.dumps(entry, default=str) + '\n'
+        with self._lock:
+            self.entries[url] = entry
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
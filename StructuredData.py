@@ -0,0 +1,208 @@
+import html
+import json
+import re
+
+from ContentExtractor import parse_html
+from DateParser import parse_iso
+
+# Event fields found in structured data, and the words of a column name (or else its prompt) that ask for them.
+# Checked in order, so "Organizer Name" is the organizer rather than the event name.
+FIELD_PATTERNS = [
+    ('organizer', re.compile(r'organi[sz]er|\bhost', re.IGNORECASE)),
+    ('start', re.compile(r'start|begin', re.IGNORECASE)),
+    ('end', re.compile(r'\bend|finish', re.IGNORECASE)),
+    ('location', re.compile(r'location|address|venue|where|place', re.IGNORECASE)),
+    ('description', re.compile(r'description|summary|about', re.IGNORECASE)),
+    ('name', re.compile(r'name|title', re.IGNORECASE)),
+]
+
+DATE_FIELDS = ('start', 'end')
+
+# OpenGraph and Facebook event meta properties, used for the fields JSON-LD and microdata do not have
+OPENGRAPH_PROPERTIES = {
+    'og:title': 'name',
+    'og:description': 'description',
+    'event:start_time': 'start',
+    'event:end_time': 'end',
+}
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def map_columns(column_mapping):
+    """Maps each column to the structured data field it asks for, or None when none fits."""
+    columns = {}
+    for column, prompt in column_mapping.items():
+        columns[column] = None
+        for text in (column, prompt):
+            field = next((field for field, pattern in FIELD_PATTERNS if pattern.search(text)), None)
+            if field is not None:
+                columns[column] = field
+                break
+    return columns
+
+
+def is_event_type(value):
+    """True for schema.org Event and its subtypes (MusicEvent, EducationEvent, ...), also given as URLs or lists."""
+    types = value if isinstance(value, list) else [value]
+    return any(isinstance(type_, str) and type_.rsplit('/', 1)[-1].endswith('Event') for type_ in types)
+
+
+def walk_json_ld(value):
+    """Yields every object of a JSON-LD document, descending into lists, @graph and nested properties."""
+    if isinstance(value, list):
+        for item in value:
+            yield from walk_json_ld(item)
+    elif isinstance(value, dict):
+        yield value
+        for key, item in value.items():
+            if isinstance(item, (list, dict)):
+                yield from walk_json_ld(item)
+
+
+def json_ld_events(root):
+    """Event objects of the page's application/ld+json scripts, in page order."""
+    events = []
+    for script in root.xpath('//script[@type="application/ld+json"]'):
+        try:
+            document = json.loads(script.text_content(), strict=False)
+        except (ValueError, TypeError):
+            continue
+        events.extend(item for item in walk_json_ld(document) if is_event_type(item.get('@type')))
+    return events
+
+
+def microdata_item(element):
+    """The itemprops of an itemscope element as a dict, nested itemscopes become nested dicts."""
+    item = {'@type': element.get('itemtype', '')}
+    for prop in element.iterdescendants():
+        if not isinstance(prop.tag, str) or prop.get('itemprop') is None:
+            continue
+        # Properties of a nested item belong to that item
+        owner = next((ancestor for ancestor in prop.iterancestors() if ancestor.get('itemscope') is not None), None)
+        if owner is not element:
+            continue
+        if prop.get('itemscope') is not None:
+            value = microdata_item(prop)
+        else:
+            value = (prop.get('content') or prop.get('datetime') or prop.get('href') or prop.get('src')
+                     or prop.text_content())
+        for name in prop.get('itemprop').split():
+            item.setdefault(name, value)
+    return item
+
+
+def microdata_events(root):
+    """Event items marked up with schema.org microdata, in page order."""
+    return [microdata_item(element) for element in root.xpath('//*[@itemscope][contains(@itemtype, "schema.org")]')
+            if is_event_type(element.get('itemtype'))]
+
+
+def opengraph_fields(root):
+    """Event fields of the page's OpenGraph / Facebook event meta tags."""
+    fields = {}
+    for meta in root.xpath('//meta[@property]'):
+        field = OPENGRAPH_PROPERTIES.get(meta.get('property', '').strip().lower())
+        if field and meta.get('content'):
+            fields.setdefault(field, meta.get('content'))
+    return fields
+
+
+def clean_text(value):
+    """Collapses whitespace and removes the HTML some sites put in their structured data."""
+    if '<' in value:
+        value = TAG_PATTERN.sub(' ', value)
+    return ' '.join(html.unescape(value).split())
+
+
+def name_of(value):
+    """The name of a schema.org Thing given as a string, an object or a list of either."""
+    if isinstance(value, list):
+        return ', '.join(filter(None, (name_of(item) for item in value)))
+    if isinstance(value, dict):
+        return clean_text(str(value.get('name') or value.get('url') or value.get('@id') or ''))
+    return clean_text(str(value)) if value else ''
+
+
+def address_of(value):
+    """A one line address from a Place, PostalAddress or VirtualLocation, 'Online' for virtual locations."""
+    if isinstance(value, list):
+        addresses = [address_of(item) for item in value]
+        physical = [address for address in addresses if address and address != 'Online']
+        return physical[0] if physical else next((address for address in addresses if address), '')
+    if not isinstance(value, dict):
+        return clean_text(str(value)) if value else ''
+    if is_virtual(value.get('@type')):
+        return 'Online'
+
+    address = value.get('address', value)
+    if isinstance(address, dict):
+        region = ' '.join(filter(None, (str(address.get('addressRegion') or ''),
+                                        str(address.get('postalCode') or ''))))
+        parts = [address.get('streetAddress'), address.get('addressLocality'), region,
+                 name_of(address.get('addressCountry'))]
+        address = ', '.join(clean_text(str(part)) for part in parts if part)
+    else:
+        address = clean_text(str(address or ''))
+
+    name = clean_text(str(value.get('name') or ''))
+    if name and address and name not in address:
+        return f"{name}, {address}"
+    return address or name
+
+
+def is_virtual(type_value):
+    types = type_value if isinstance(type_value, list) else [type_value]
+    return any(isinstance(type_, str) and type_.rsplit('/', 1)[-1] == 'VirtualLocation' for type_ in types)
+
+
+def format_date(value):
+    """ISO dates are written in the prompt's format, other strings are left for parse_dates."""
+    text = clean_text(str(value))
+    parsed = parse_iso(text)
+    return parsed.strftime('%B %d, %Y, %I:%M %p') if parsed else text
+
+
+def event_fields(event):
+    """Fields of a JSON-LD or microdata Event object, empty ones left out."""
+    location = address_of(event.get('location'))
+    if not location and 'Online' in str(event.get('eventAttendanceMode', '')):
+        location = 'Online'
+    fields = {
+        'name': name_of(event.get('name')),
+        'start': format_date(event['startDate']) if event.get('startDate') else '',
+        'end': format_date(event['endDate']) if event.get('endDate') else '',
+        'location': location,
+        'description': clean_text(str(event.get('description') or '')),
+        'organizer': name_of(event.get('organizer')),
+    }
+    return {field: value for field, value in fields.items() if value}
+
+
+class StructuredDataExtractor:
+    """
+    Reads the event fields a page publishes as schema.org JSON-LD, microdata or OpenGraph tags and maps them to the
+    columns of column_mapping. Sources are used in that order, per field.
+    """
+
+    def __init__(self, column_mapping):
+        self.columns = map_columns(column_mapping)
+
+    def extract(self, html_content):
+        """Returns {column: value} for the columns the page's structured data fills, {} when it has none."""
+        root = parse_html(html_content)
+        if root is None:
+            return {}
+
+        events = json_ld_events(root) or microdata_events(root)
+        fields = event_fields(events[0]) if events else {}
+
+        # og:title and og:description alone do not make a page an event, its start time or event markup does
+        opengraph = opengraph_fields(root)
+        if not events and 'start' not in opengraph:
+            opengraph = {}
+        for field, value in opengraph.items():
+            if field not in fields:
+                fields[field] = format_date(value) if field in DATE_FIELDS else clean_text(value)
+
+        return {column: fields[field] for column, field in self.columns.items() if field in fields}
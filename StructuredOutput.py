@@ -0,0 +1,112 @@
+import json
+import re
+
+# Name of the function the model is asked to call with the extracted fields
+EXTRACTION_FUNCTION = "record_event"
+
+FENCE_PATTERN = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+
+
+def event_schema(column_mapping):
+    """Function definition whose arguments are the columns of column_mapping, described by their prompts."""
+    return {
+        "name": EXTRACTION_FUNCTION,
+        "description": "Records the details of the event described on the webpage.",
+        "parameters": {
+            "type": "object",
+            "properties": {column: {"type": "string", "description": prompt.strip()}
+                           for column, prompt in column_mapping.items()},
+            "required": list(column_mapping.keys()),
+        },
+    }
+
+
+def close_json(text):
+    """Closes the string, arrays and objects left open by a truncated JSON document."""
+    closers = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif char in '}]' and closers:
+            closers.pop()
+
+    if in_string:
+        text += '\\' if escaped else ''
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(','):
+        text = text[:-1]
+    elif text.endswith(':'):
+        text += ' null'
+    return text + ''.join(reversed(closers))
+
+
+def load_json_object(content):
+    """
+    Parses the JSON object in content, returns (object, repaired). Code fences and text around the object are
+    ignored; trailing commas and a truncated end are repaired. Raises ValueError when no object can be recovered.
+    """
+    text = FENCE_PATTERN.sub('', content.strip())
+    start = text.find('{')
+    if start == -1:
+        raise ValueError("No JSON object in the response.")
+    end = text.rfind('}')
+    candidate = text[start:end + 1] if end > start else text[start:]
+
+    try:
+        value = json.loads(candidate)
+        if isinstance(value, dict):
+            return value, False
+    except json.JSONDecodeError:
+        pass
+
+    repaired = close_json(TRAILING_COMMA_PATTERN.sub(r'\1', text[start:]))
+    try:
+        value = json.loads(TRAILING_COMMA_PATTERN.sub(r'\1', repaired))
+        if isinstance(value, dict):
+            return value, True
+    except json.JSONDecodeError:
+        pass
+
+    # Last resort: pick the "key": "value" pairs out one by one
+    pairs = re.findall(r'"((?:[^"\\]|\\.)*)"\s*:\s*"((?:[^"\\]|\\.)*)"', text[start:])
+    if not pairs:
+        raise ValueError("Could not repair the JSON in the response.")
+    return {json.loads(f'"{key}"'): json.loads(f'"{value}"') for key, value in pairs}, True
+
+
+def parse_event_fields(content, columns):
+    """
+    Returns (values, repaired) for the columns, in order, from a JSON answer. Keys are matched case-insensitively
+    and missing columns are left empty, so a partial answer still fills the fields it has. Raises ValueError when
+    none of the columns can be found.
+    """
+    data, repaired = load_json_object(content)
+    by_key = {str(key).strip().lower(): value for key, value in data.items()}
+
+    values, found = [], 0
+    for column in columns:
+        value = by_key.get(column.strip().lower())
+        if value is None:
+            repaired = True
+            values.append('')
+            continue
+        found += 1
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value) if isinstance(value, dict) else ', '.join(str(item) for item in value)
+        values.append(' '.join(str(value).split()))
+
+    if not found:
+        raise ValueError("None of the event fields are in the response.")
+    return values, repaired
@@ -0,0 +1,18 @@
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings = {}
+
+
+def estimate_tokens(text, model="gpt-3.5-turbo"):
+    """Counts the tokens of text with tiktoken when installed, otherwise estimates them at 4 characters a token."""
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return len(_encodings[model].encode(text, disallowed_special=()))
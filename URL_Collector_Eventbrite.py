@@ -1,9 +1,12 @@
 import os
-import requests
 from bs4 import BeautifulSoup
 import csv
 import time
 
+from HTTPClient import HTTPClient, REQUEST_ERRORS
+from PageCache import PageCache
+from RateLimiter import DomainRateLimiter
+
 # Base URL without city and term
 URL_TEMPLATE = "https://www.eventbrite.com/d/{city}/{term}/?page="
 
@@ -16,6 +19,12 @@ headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
+# Listing pages change as events get added, so cached copies are revalidated after a few hours
+CACHE_DIR = "./Cache/listings"
+CACHE_TTL = 6 * 3600
+
+http_client = HTTPClient(cache=PageCache(CACHE_DIR, ttl=CACHE_TTL), rate_limiter=DomainRateLimiter())
+
 def ensure_directory_exists(directory):
     """Ensure that the output directory exists."""
     if not os.path.exists(directory):
@@ -29,12 +38,12 @@ def seconds_to_hms(seconds):
 
 def get_event_links(url):
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_client.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         soup = BeautifulSoup(response.content, 'html.parser')
         events = soup.select('.horizontal-event-card__action-visibility .Stack_root__1ksk7 a')
         return [event['href'] for event in events if event.has_attr('href')]
-    except requests.RequestException as e:
+    except REQUEST_ERRORS as e:
         print(f"Request error for {url}: {e}")
         return []
     except Exception as e:
@@ -1,4 +1,3 @@
-import requests
 from bs4 import BeautifulSoup
 import csv
 import time
@@ -6,10 +5,20 @@ import os
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
+from HTTPClient import HTTPClient
+from PageCache import PageCache
+from RateLimiter import DomainRateLimiter
+
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
+# Listing pages change as events get added, so cached copies are revalidated after a few hours
+CACHE_DIR = "./Cache/listings"
+CACHE_TTL = 6 * 3600
+
+http_client = HTTPClient(cache=PageCache(CACHE_DIR, ttl=CACHE_TTL), rate_limiter=DomainRateLimiter())
+
 # List of web pages to scrape
 web_pages = [
     'https://www.weact.org/latest/events/',
@@ -129,7 +138,7 @@ for index, web_page in enumerate(web_pages):
         continue
 
     try:
-        response = requests.get(web_page, headers=headers)
+        response = http_client.get(web_page, headers=headers)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         urls = custom_parsers[web_page](soup)
@@ -7,7 +7,7 @@ import traceback
 from tkinter import filedialog, ttk
 import tkinter as tk
 
-from EventExtractor import EventExtractor
+from EventExtractor import EventExtractor, DEFAULT_COLUMN_MAPPING, parse_column_mapping, format_column_mapping
 
 
 class Tooltip:
@@ -68,18 +68,14 @@ class Console(tk.Text):
 class App:
     def __init__(self, root):
 
-        self.default_column_mapping = '''Event Name: The name of the event 
-Start: The start datetime of the event in the following format: Month Day, Year, Hour:Minute AM/PM 
-End: The end datetime of the event in the following format: Month Day, Year, Hour:Minute AM/PM 
-Location: The full address of the event 
-Description: A description of the event
-Organizer: The organizer of the event'''
+        self.default_column_mapping = format_column_mapping(DEFAULT_COLUMN_MAPPING)
 
         self.open_file_var = tk.BooleanVar()
+        self.resume_var = tk.BooleanVar()
         self.root = root
         self.root.title("Event Extractor")
         window_width = 530
-        window_height = 410
+        window_height = 500
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
         position_top = int(screen_height / 2 - window_height / 2)
@@ -96,6 +92,7 @@ Organizer: The organizer of the event'''
         self.button_csv = tk.Button(root, text="Browse", command=self.load_csv_files)
         self.button_run = tk.Button(root, text="Run", width=5, command=self.run_event_extractor)
         self.button_output_dir = tk.Button(root, text="Browse", command=self.select_output_dir)
+        self.button_relevance_model = tk.Button(root, text="Browse", command=self.select_relevance_model)
 
         script_dir = os.path.dirname(os.path.abspath(__file__))  # get directory of the script
 
@@ -107,6 +104,10 @@ Organizer: The organizer of the event'''
         self.column_mapping_text = tk.Text(root, width=width_std, height=5, wrap=tk.NONE, highlightthickness=0)
         self.column_mapping_text.insert(tk.END, self.default_column_mapping)
         self.csv_display = tk.Text(root, height=3, width=width_std, highlightthickness=0)
+        self.relevance_var = tk.StringVar(value='GPT-4')
+        self.combo_relevance = ttk.Combobox(root, textvariable=self.relevance_var, values=('GPT-4', 'DistilBERT'),
+                                            state='readonly', width=width_std - 3)
+        self.relevance_model_path = ''
 
         self.csv_display.config(state='disabled')
         self.entry_output_dir.config(state='disabled')
@@ -117,12 +118,18 @@ Organizer: The organizer of the event'''
         self.label_csv = tk.Label(root, text="Select URL Files:")
         self.label_output = tk.Label(root, text="Select Output:")
         self.label_num_rows = tk.Label(root, text="Rows to Process:")
+        self.label_relevance = tk.Label(root, text="Relevance Check:")
         self.checkbox_open_file = tk.Checkbutton(root, text="Open file upon completion", variable=self.open_file_var)
+        self.checkbox_resume = tk.Checkbutton(root, text="Resume previous run", variable=self.resume_var)
 
         # Add tooltips to buttons
         csv_tooltip = Tooltip(self.button_csv, "Shift click to select multiple csv files")
         output_dir_tooltip = Tooltip(self.button_output_dir, "Browse for the output directory")
         api_key_tooltip = Tooltip(self.entry_api_key, "Input API key environment variable")
+        relevance_model_tooltip = Tooltip(self.button_relevance_model,
+                                          "Browse for the DistilBERT checkpoint folder made by Train.py")
+        resume_tooltip = Tooltip(self.checkbox_resume,
+                                 "Skip the URLs a previous run with the same identifier\nand URL files already finished")
 
         # Add tooltips to text widgets
         city_tooltip = Tooltip(self.entry_city, "The city name(s) are a good pick")
@@ -159,9 +166,15 @@ Organizer: The organizer of the event'''
         self.label_column_mapping.grid(padx=padx_std, pady=(0, pady_std), row=8, column=0, sticky="nw")
         self.column_mapping_text.grid(row=8, column=1, sticky='w')
 
-        self.button_run.grid(row=9, column=0, pady=pady_std)
-        self.button_cancel.grid(row=9, column=1)
-        self.checkbox_open_file.grid(padx=12, row=9, column=2, columnspan=2)
+        self.label_relevance.grid(padx=padx_std, row=9, column=0, sticky="w")
+        self.combo_relevance.grid(row=9, column=1, sticky="w")
+
+        self.button_relevance_model.grid(row=10, pady=(0, pady_std), column=1, sticky="ew")
+
+        self.button_run.grid(row=11, column=0, pady=pady_std)
+        self.button_cancel.grid(row=11, column=1)
+        self.checkbox_open_file.grid(padx=12, row=11, column=2, columnspan=2)
+        self.checkbox_resume.grid(padx=12, row=12, column=2, columnspan=2, sticky="w")
 
         # Load saved data
         if os.path.exists('saved_data.pkl'):
@@ -190,6 +203,9 @@ Organizer: The organizer of the event'''
                 self.entry_output_dir.delete('1.0', tk.END)
                 self.entry_output_dir.insert(tk.END, self.saved_data.get('output_directory', ''))
 
+                self.relevance_var.set(self.saved_data.get('relevance_backend', 'GPT-4'))
+                self.relevance_model_path = self.saved_data.get('relevance_model_path', '')
+
                 self.csv_display.config(state='disabled')
                 self.entry_output_dir.config(state='disabled')
 
@@ -225,6 +241,17 @@ Organizer: The organizer of the event'''
 
         self.entry_output_dir.config(state='disabled')
 
+    def select_relevance_model(self):
+        initial_dir = self.relevance_model_path or os.getcwd()
+
+        new_model_dir = filedialog.askdirectory(initialdir=initial_dir, mustexist=True)
+
+        # Picking a checkpoint implies the user wants the local model
+        if new_model_dir:
+            self.relevance_model_path = new_model_dir
+            self.relevance_var.set('DistilBERT')
+            print(f"Relevance model: {new_model_dir}")
+
     def save_data(self):
         # Save data
         self.saved_data = {
@@ -234,6 +261,8 @@ Organizer: The organizer of the event'''
             'num_rows': self.entry_num_rows.get('1.0', 'end').strip(),
             'column_mapping': self.column_mapping_text.get('1.0', 'end').strip(),
             'output_directory': self.entry_output_dir.get('1.0', 'end').strip(),
+            'relevance_backend': self.relevance_var.get(),
+            'relevance_model_path': self.relevance_model_path,
         }
         with open('saved_data.pkl', 'wb') as f:
             pickle.dump(self.saved_data, f)
@@ -246,10 +275,14 @@ Organizer: The organizer of the event'''
         city = self.entry_city.get('1.0', 'end')
         column_mapping_str = self.column_mapping_text.get('1.0', 'end')
         output_dir = self.entry_output_dir.get('1.0', 'end').strip()
-        column_mapping = dict(item.split(": ", 1) for item in column_mapping_str.split("\n") if item)
+        column_mapping = parse_column_mapping(column_mapping_str)
+        relevance_backend = 'distilbert' if self.relevance_var.get() == 'DistilBERT' else 'gpt'
 
         try:
-            extractor = EventExtractor(api_key, csv, column_mapping, city, output_dir, num_rows)
+            extractor = EventExtractor(api_key, csv, column_mapping, city, output_dir, num_rows,
+                                       relevance_backend=relevance_backend,
+                                       relevance_model_path=self.relevance_model_path or None,
+                                       resume=self.resume_var.get())
             self.thread = threading.Thread(target=self.run_in_thread, args=(extractor,))
             self.thread.start()
         except Exception as e: